@@ -0,0 +1,133 @@
+# agents/assignment.py
+
+import os
+
+import numpy as np
+
+from agents.insight_agent import MatchFeatures, SCORE_BLOCK_CELLS, score_candidates
+from agents.score_pool import pack_features, negotiation_codes, REJECTED, ACCEPTED, COUNTER_OFFER
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # fall back to weight-ordered greedy selection
+    linear_sum_assignment = None
+
+# Global assignment of needs to offers for one match cycle.
+# Every tag-compatible, same-product pair that would not be rejected is an
+# edge weighted by its negotiation outcome and score; each product name is an
+# independent component solved as a maximum-weight assignment in which an
+# offer appears once per unit of capacity. Needs without an acceptable edge
+# are left open for a later cycle instead of being rejected.
+
+# Needs a single offer can settle per cycle, unless the offer carries
+# "capacity". 0 (default) means unbounded: settling never consumes an offer in
+# this system, so only offers with an explicit capacity are limited.
+MATCH_OFFER_CAPACITY = int(os.getenv("MATCH_OFFER_CAPACITY", 0))
+
+# Edge weight = outcome weight + score + a bonus up to PRICE_BONUS for the
+# share of the buyer's price_max left unspent, so an accepted deal always
+# beats a counter-offer and cheaper offers win ties
+OUTCOME_WEIGHTS = {ACCEPTED: 2.0, COUNTER_OFFER: 1.0}
+PRICE_BONUS     = 0.1
+
+
+def offer_capacity(offer):
+    """Needs the offer can settle per cycle, or None when unbounded."""
+    capacity = offer.get("capacity")
+    if capacity is None:
+        return MATCH_OFFER_CAPACITY or None
+    return max(0, int(capacity))
+
+
+def candidate_edges(needs, offers):
+    """
+    Weighted candidate graph as aligned arrays
+    (need_index, offer_index, score, status, weight, component), where the
+    component is the pair's product-name code.
+    """
+    arrays = pack_features(needs, offers)
+    f = MatchFeatures.from_arrays(arrays)
+    ni, oi, score = score_candidates(needs, offers, features=f)
+    ask, cap = arrays["offer_ask"][oi], f.price_max[ni]
+    status = negotiation_codes(ask, cap, arrays["offer_margin"][oi])
+    keep = status != REJECTED
+    ni, oi, score, status, ask, cap = ni[keep], oi[keep], score[keep], status[keep], ask[keep], cap[keep]
+
+    outcome = np.where(status == ACCEPTED, OUTCOME_WEIGHTS[ACCEPTED], OUTCOME_WEIGHTS[COUNTER_OFFER])
+    savings = np.clip((cap - ask) / np.where(cap > 0, cap, 1), 0, 1)
+    return ni, oi, score, status, outcome + score + PRICE_BONUS * savings, f.need_name[ni]
+
+
+def _best_per_need(rows, weight):
+    """Each need's heaviest edge; exact when no offer in the component is limited."""
+    best = {}
+    for e in np.argsort(-weight, kind="stable"):
+        best.setdefault(rows[e], e)
+    return list(best.values())
+
+
+def _greedy(rows, cols, weight, capacity):
+    """Heaviest edges first; 1/2-approximation used without SciPy."""
+    taken, left = set(), dict(capacity)
+    chosen = []
+    for e in np.argsort(-weight, kind="stable"):
+        n, o = rows[e], cols[e]
+        if n in taken or left[o] <= 0:
+            continue
+        taken.add(n)
+        left[o] -= 1
+        chosen.append(e)
+    return chosen
+
+
+def _optimal(rows, cols, weight, capacity):
+    """Exact maximum-weight assignment with offers expanded into capacity slots."""
+    need_ids, r = np.unique(rows, return_inverse=True)
+    offer_ids, c = np.unique(cols, return_inverse=True)
+    slots = np.array([min(capacity[o], len(need_ids)) for o in offer_ids])
+    first_slot = np.concatenate(([0], np.cumsum(slots)[:-1]))
+
+    matrix = np.zeros((len(need_ids), int(slots.sum())))
+    edge_at = np.full(matrix.shape, -1, dtype=np.int64)
+    for k in range(int(slots.max())):
+        has = slots[c] > k
+        matrix[r[has], first_slot[c[has]] + k] = weight[has]
+        edge_at[r[has], first_slot[c[has]] + k] = np.flatnonzero(has)
+
+    row_ind, col_ind = linear_sum_assignment(matrix, maximize=True)
+    edges = edge_at[row_ind, col_ind]
+    return [int(e) for e in edges if e >= 0]
+
+
+def assign(needs, offers):
+    """
+    Solve the cycle's assignment. Returns (need_index, offer_index, score,
+    status) tuples, at most one per need and at most the offer's capacity per
+    offer. Components where no offer has a capacity limit reduce to each
+    need's best edge; components too large for a dense matrix are solved
+    greedily.
+    """
+    ni, oi, score, status, weight, component = candidate_edges(needs, offers)
+    limits = {o: offer_capacity(offers[o]) for o in np.unique(oi).tolist()}
+
+    result = []
+    order = np.argsort(component, kind="stable")
+    bounds = np.flatnonzero(np.diff(component[order])) + 1
+    for group in np.split(order, bounds) if len(order) else []:
+        rows, cols, w = ni[group], oi[group], weight[group]
+        n_needs = len(np.unique(rows))
+        offer_ids = set(cols.tolist())
+        # An unbounded offer can take every need in the component
+        capacity = {o: n_needs if limits[o] is None else limits[o] for o in offer_ids}
+        slots = sum(min(capacity[o], n_needs) for o in offer_ids)
+        if all(limits[o] is None for o in offer_ids):
+            chosen = _best_per_need(rows.tolist(), w)
+        elif linear_sum_assignment is not None and n_needs * slots <= SCORE_BLOCK_CELLS:
+            chosen = _optimal(rows, cols, w, capacity)
+        else:
+            chosen = _greedy(rows.tolist(), cols.tolist(), w, capacity)
+        for e in chosen:
+            g = group[e]
+            result.append((int(ni[g]), int(oi[g]), float(score[g]), int(status[g])))
+    result.sort()
+    return result
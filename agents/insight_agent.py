@@ -1,21 +1,21 @@
-import redis, json, os
-from agents.needs_agent import get_need, get_current_needs
+import json
+import numpy as np
+from agents.needs_agent import get_need, find_needs
 from agents.opportunity_agent import get_offer
+from agents.tags import need_tag_mask, offer_tag_mask
+from db.client import get_client
 
-# Read Redis connection info from env (set in docker-compose.yml)
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+# Shared pooled Redis client (connection settings live in db/client.py)
+r = get_client()
+
+def offer_product_name(offer):
+    # Offers embed the product under "product": {..., "name": "..."}
+    return offer.get("product", {}).get("name") or offer.get("product_name")
 
-r = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=0,
-    decode_responses=True
-)
 
 def process_match(user_id, offer_id):
-    needs = get_current_needs()
-    need = next((n for n in needs if n.get("user_id") == user_id), None)
+    needs = find_needs(user_id=user_id)
+    need = needs[0] if needs else None
     if not need:
         return {"score": 0.0}
 
@@ -23,10 +23,16 @@ def process_match(user_id, offer_id):
     if not offer:
         return {"score": 0.0}
 
+    return score_match(need, offer)
+
+
+def score_match(need, offer):
+    """
+    Score an already-loaded need/offer pair (no Redis access).
+    """
     # 1) Must be same product **name**
     need_name  = need.get("product_name")
-    # Offers embed the product under "product": {..., "name": "..."}
-    offer_name = offer.get("product", {}).get("name") or offer.get("product_name")
+    offer_name = offer_product_name(offer)
     if not need_name or need_name != offer_name:
         return {"score": 0.0}
 
@@ -35,4 +41,111 @@ def process_match(user_id, offer_id):
     max_price = need.get("preferences", {}).get("price_max", 0)
     score     = 1.0 if price <= max_price else 0.5
 
-    return {"score": score}
\ No newline at end of file
+    return {"score": score}
+
+
+# ─── Batch scoring ──────────────────────────────────────────────────────────
+# Vectorised equivalent of score_match for already-loaded populations.
+# Needs and offers are packed once into NumPy arrays (product names as integer
+# codes, prices, tag bitmasks) and whole blocks of pairs are scored at a time.
+
+# Upper bound on need × offer cells evaluated per block, to bound memory
+SCORE_BLOCK_CELLS = 4_000_000
+
+
+class MatchFeatures:
+    """
+    Columnar view of needs and offers: name codes (-1 = no name), need
+    price_max, offer product price, interned tag bitmasks (agents/tags.py) and
+    whether each need asked for tags at all.
+    """
+
+    ARRAYS = ("need_name", "offer_name", "price_max", "offer_price",
+              "need_has_tags", "need_tags", "offer_tags")
+
+    def __init__(self, needs, offers):
+        names = {}
+
+        def name_code(name):
+            return names.setdefault(name, len(names)) if name else -1
+
+        self.need_name   = np.array([name_code(n.get("product_name")) for n in needs], dtype=np.int64)
+        self.offer_name  = np.array([name_code(offer_product_name(o)) for o in offers], dtype=np.int64)
+        self.price_max   = np.array([n.get("preferences", {}).get("price_max", 0) or 0 for n in needs], dtype=np.float64)
+        self.offer_price = np.array([o.get("product", {}).get("price", 0) or 0 for o in offers], dtype=np.float64)
+
+        need_masks  = [need_tag_mask(n) for n in needs]
+        offer_masks = [offer_tag_mask(o) for o in offers]
+        # Python ints keep working (slower) once tags use bits past 63
+        mask_dtype = np.uint64 if max(need_masks + offer_masks, default=0) < 1 << 64 else object
+        self.need_tags  = np.array(need_masks, dtype=mask_dtype)
+        self.offer_tags = np.array(offer_masks, dtype=mask_dtype)
+        self.need_has_tags = np.array([m != 0 for m in need_masks], dtype=bool)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild features from their ARRAYS (e.g. views on shared memory)."""
+        f = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(f, name, arrays[name])
+        return f
+
+    def scores(self, need_idx, offer_idx):
+        """Score block for the given need rows × offer columns."""
+        same  = self.need_name[need_idx][:, None] == self.offer_name[offer_idx][None, :]
+        same &= self.need_name[need_idx][:, None] >= 0
+        cheap = self.offer_price[offer_idx][None, :] <= self.price_max[need_idx][:, None]
+        return np.where(same, np.where(cheap, 1.0, 0.5), 0.0)
+
+    def tag_overlap(self, need_idx, offer_idx):
+        """Tag pre-filter block: need has no tags, or shares at least one."""
+        shared = (self.need_tags[need_idx][:, None] & self.offer_tags[offer_idx][None, :]) != 0
+        return shared | ~self.need_has_tags[need_idx][:, None]
+
+
+def score_matrix(needs, offers, features=None):
+    """
+    Score every need against every offer; returns a len(needs) × len(offers)
+    array holding the score_match value of each pair. Memory grows with the
+    product of the sizes, so prefer score_candidates for large populations.
+    """
+    f = features or MatchFeatures(needs, offers)
+    return f.scores(np.arange(len(needs)), np.arange(len(offers)))
+
+
+def score_candidates(needs, offers, apply_tag_filter=True, features=None):
+    """
+    Return every pair scoring above zero as three aligned arrays
+    (need_index, offer_index, score), ordered by need then offer index.
+    Only needs and offers sharing a product name are compared, block by
+    block, and with `apply_tag_filter` pairs failing the tag pre-filter are
+    dropped, as the match worker does.
+    """
+    f = features or MatchFeatures(needs, offers)
+    need_rows, offer_cols, values = [], [], []
+
+    offers_by_name = {}
+    for code in np.unique(f.offer_name[f.offer_name >= 0]):
+        offers_by_name[code] = np.flatnonzero(f.offer_name == code)
+
+    for code, offer_idx in offers_by_name.items():
+        need_idx = np.flatnonzero(f.need_name == code)
+        step = max(1, SCORE_BLOCK_CELLS // len(offer_idx))
+        for start in range(0, len(need_idx), step):
+            rows  = need_idx[start:start + step]
+            block = f.scores(rows, offer_idx)
+            if apply_tag_filter:
+                block = np.where(f.tag_overlap(rows, offer_idx), block, 0.0)
+            r_i, c_i = np.nonzero(block > 0)
+            need_rows.append(rows[r_i])
+            offer_cols.append(offer_idx[c_i])
+            values.append(block[r_i, c_i])
+
+    if not values:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float64)
+    need_rows  = np.concatenate(need_rows)
+    offer_cols = np.concatenate(offer_cols)
+    values     = np.concatenate(values)
+    order = np.lexsort((offer_cols, need_rows))
+    return need_rows[order], offer_cols[order], values[order]
@@ -0,0 +1,137 @@
+# agents/match_engine.py
+
+from collections import defaultdict
+
+from agents.insight_agent import offer_product_name
+from agents.tags import need_tag_mask, offer_tag_mask, mask_bits
+
+# In-memory join of needs against offers.
+# score_match only scores pairs whose product names are equal, so instead of
+# comparing every need with every offer the offers are bucketed by product
+# name once per cycle and each need is only paired with its own bucket.
+
+
+# Bucket key in WorkingSet.needs_by_tag for needs that asked for no tags
+UNTAGGED = -1
+
+
+def tags_compatible(need, offer):
+    """
+    Tag pre-filter: a need without tags accepts any offer, otherwise at least
+    one tag must be shared (one AND of the interned tag masks).
+    """
+    wanted = need_tag_mask(need)
+    return not wanted or bool(wanted & offer_tag_mask(offer))
+
+
+def bucket_offers(offers):
+    """Group offers by product name (offers without a name can never match)."""
+    buckets = defaultdict(list)
+    for offer in offers:
+        name = offer_product_name(offer)
+        if name:
+            buckets[name].append(offer)
+    return buckets
+
+
+def candidate_offers(needs, offers):
+    """
+    Hash join of needs and offers on product name.
+    Yields (need, offers) for every need whose product has live offers, where
+    `offers` lazily applies the tag pre-filter to that bucket, so a caller
+    that stops at the first usable offer never scans the rest. Cost is
+    O(needs + offers + pairs visited) instead of O(needs × offers).
+    """
+    buckets = bucket_offers(offers)
+    for need in needs:
+        bucket = buckets.get(need.get("product_name"))
+        if bucket:
+            yield need, (offer for offer in bucket if tags_compatible(need, offer))
+
+
+class WorkingSet:
+    """
+    In-memory copy of the live needs and offers, bucketed by product name,
+    kept current from events by the incremental matcher. Adding an item with
+    a known id replaces it (e.g. an offer republished after a price change).
+    Needs are also indexed by (product name, tag bit), so a new offer only
+    enumerates the needs that share one of its tags or asked for none.
+    """
+
+    def __init__(self):
+        self.needs  = {}                      # need_id -> need
+        self.offers = {}                      # offer_id -> offer
+        self.needs_by_name  = defaultdict(dict)
+        self.needs_by_tag   = defaultdict(dict)  # (name, bit or UNTAGGED) -> {need_id: need}
+        self.offers_by_name = defaultdict(dict)
+
+    def replace(self, needs, offers):
+        """Swap in a fresh snapshot (reconciliation sweep)."""
+        self.__init__()
+        for need in needs:
+            self.add_need(need)
+        for offer in offers:
+            self.add_offer(offer)
+
+    def add_need(self, need):
+        need_id = need.get("need_id")
+        if need_id is None:
+            return
+        self.remove_need(need_id)
+        self.needs[need_id] = need
+        name = need.get("product_name")
+        if name:
+            self.needs_by_name[name][need_id] = need
+            for bit in self._need_bits(need):
+                self.needs_by_tag[(name, bit)][need_id] = need
+
+    def remove_need(self, need_id):
+        need = self.needs.pop(need_id, None)
+        if need is not None:
+            name = need.get("product_name")
+            self._unbucket(self.needs_by_name, name, need_id)
+            for bit in self._need_bits(need):
+                self._unbucket(self.needs_by_tag, (name, bit), need_id)
+
+    @staticmethod
+    def _need_bits(need):
+        return list(mask_bits(need_tag_mask(need))) or [UNTAGGED]
+
+    def add_offer(self, offer):
+        offer_id = offer.get("offer_id")
+        if offer_id is None:
+            return
+        self.remove_offer(offer_id)
+        self.offers[offer_id] = offer
+        name = offer_product_name(offer)
+        if name:
+            self.offers_by_name[name][offer_id] = offer
+
+    def remove_offer(self, offer_id):
+        offer = self.offers.pop(offer_id, None)
+        if offer is not None:
+            self._unbucket(self.offers_by_name, offer_product_name(offer), offer_id)
+
+    @staticmethod
+    def _unbucket(buckets, name, item_id):
+        bucket = buckets.get(name)
+        if bucket is not None:
+            bucket.pop(item_id, None)
+            if not bucket:
+                del buckets[name]
+
+    def offers_for(self, need):
+        """Tag-compatible live offers for the need's product (lazy)."""
+        bucket = self.offers_by_name.get(need.get("product_name"), {})
+        return (offer for offer in list(bucket.values()) if tags_compatible(need, offer))
+
+    def needs_for(self, offer):
+        """
+        Waiting needs for the offer's product that accept its tags, read from
+        the inverted tag index, so no pair needs the pre-filter.
+        """
+        name  = offer_product_name(offer)
+        found = dict(self.needs_by_tag.get((name, UNTAGGED), {}))
+        for bit in mask_bits(offer_tag_mask(offer)):
+            found.update(self.needs_by_tag.get((name, bit), {}))
+        return iter(list(found.values()))
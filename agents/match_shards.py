@@ -0,0 +1,105 @@
+# agents/match_shards.py
+
+import hashlib
+import os
+import socket
+import time
+import zlib
+
+from db.client import get_client, pipelined
+
+# Partitioning of matching across match worker processes.
+# Needs and offers can only match on equal product names, so the product name
+# decides the shard (a stable CRC32, unlike Python's salted hash()). Every
+# worker heartbeats into a registry; each one reads the same list of live
+# workers and assigns shards by rendezvous hashing, so all workers agree
+# without coordinating and a join or leave only moves the shards of the
+# worker concerned.
+
+MATCH_SHARDS             = int(os.getenv("MATCH_SHARDS", 256))
+MATCH_HEARTBEAT_INTERVAL = float(os.getenv("MATCH_HEARTBEAT_INTERVAL", 2))
+MATCH_WORKER_TTL         = int(os.getenv("MATCH_WORKER_TTL", 6))  # seconds without a heartbeat before a worker is dropped
+
+WORKERS_SET      = "match_workers:all"
+HEARTBEAT_PREFIX = "match_worker:"
+
+r = get_client()
+
+
+def _crc(text):
+    return zlib.crc32(text.encode("utf-8", "surrogateescape"))
+
+
+def _weight(worker, shard):
+    digest = hashlib.blake2b(f"{worker}:{shard}".encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_of(product_name, shards=MATCH_SHARDS):
+    return _crc(product_name) % shards
+
+
+def assign_shards(workers, shards=MATCH_SHARDS):
+    """
+    Rendezvous (highest random weight) assignment: each shard goes to the
+    worker with the highest hash of f"{worker}:{shard}". Returns worker -> set.
+    """
+    owned = {w: set() for w in workers}
+    if not workers:
+        return owned
+    for shard in range(shards):
+        owner = max(workers, key=lambda w: _weight(w, shard))
+        owned[owner].add(shard)
+    return owned
+
+
+class ShardMembership:
+    """
+    This worker's registration and current shard set. Call maybe_heartbeat()
+    from the worker loop; it returns True whenever the owned shards changed,
+    i.e. when the worker should reload its working set.
+    During a rebalance two workers may briefly both own a shard until both
+    have seen the new membership; settling stays safe since remove_need is
+    atomic and only one of them can win a given need.
+    """
+
+    def __init__(self, worker_id=None):
+        self.worker_id = worker_id or os.getenv("MATCH_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+        self.owned     = frozenset()
+        self.workers   = []
+        self._next_beat = 0.0
+
+    def heartbeat(self):
+        with pipelined(transaction=False):
+            r.set(f"{HEARTBEAT_PREFIX}{self.worker_id}", time.time(), ex=MATCH_WORKER_TTL)
+            r.sadd(WORKERS_SET, self.worker_id)
+
+        members = sorted(r.smembers(WORKERS_SET))
+        beats   = r.mget([f"{HEARTBEAT_PREFIX}{m}" for m in members])
+        live    = [m for m, beat in zip(members, beats) if beat is not None]
+        dead    = [m for m, beat in zip(members, beats) if beat is None]
+        if dead:
+            r.srem(WORKERS_SET, *dead)
+
+        owned = frozenset(assign_shards(live).get(self.worker_id, ()))
+        changed = owned != self.owned
+        if changed or live != self.workers:
+            print(f"▶️ Match worker {self.worker_id}: {len(owned)}/{MATCH_SHARDS} shards, "
+                  f"{len(live)} live worker(s)")
+        self.owned, self.workers = owned, live
+        self._next_beat = time.monotonic() + MATCH_HEARTBEAT_INTERVAL
+        return changed
+
+    def maybe_heartbeat(self):
+        if time.monotonic() < self._next_beat:
+            return False
+        return self.heartbeat()
+
+    def owns(self, product_name):
+        return bool(product_name) and shard_of(product_name) in self.owned
+
+    def leave(self):
+        """Deregister so the other workers take over our shards right away."""
+        with pipelined(transaction=False):
+            r.delete(f"{HEARTBEAT_PREFIX}{self.worker_id}")
+            r.srem(WORKERS_SET, self.worker_id)
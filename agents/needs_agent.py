@@ -1,136 +1,322 @@
 import os
-import redis
-import json
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timezone
 import random
-from agents.supplier_agent import get_current_products
+from agents.supplier_agent import get_product, get_products, random_product, random_product_ids
+from agents.tags import stored_tag_mask
+from db.redis_store import (
+    list_objects, find_objects, get_object, save_object, encode, index_keys, record_fields, ENTITY_STORAGE,
+)
+from db.client import get_client, pipelined
+from db.scripts import register_script
+from db.events import publish_event, EVENT_FIELD, EVENT_STREAM_MAXLEN
+from db.ids import new_id
+from analytics import metrics
 
 # Streams and sets for tracking need status
 SATISFIED_SET      = "metrics:satisfied"
 UNSATISFIED_SET    = "metrics:unsatisfied"
-UNSATISFIED_STREAM = "needs_unsatisfied_stream"
+UNSATISFIED_STREAM   = "needs_unsatisfied_stream"
+NEEDS_STREAM         = "needs_stream"
+NEEDS_REMOVED_STREAM = "needs_removed_stream"
 
 # Redis set for tracking registered users
 USERS_SET          = "users:all"
 
-# Read Redis connection info from env (set in docker-compose.yml)
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+# Sorted set of live need ids scored by creation time (need["created_ts"]),
+# so needs past an age threshold are found with one range query
+NEEDS_BY_TIME      = "needs:by_created"
+# Aged needs handled per range query in detect_unsatisfied
+UNSATISFIED_BATCH  = 1000
 
-r = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=0,
-    decode_responses=True
-)
+# Shared pooled Redis client (connection settings live in db/client.py)
+r = get_client()
 
 # Default TTL for needs (seconds)
 DEFAULT_NEED_TTL = 120
 
-def process_user_preferences(user_id, prefs, ttl=DEFAULT_NEED_TTL):
+# Needs written per pipeline by process_user_preferences_batch
+NEED_BATCH_SIZE  = int(os.getenv("NEED_BATCH_SIZE", 1000))
+
+
+def need_indexes(need):
     """
-    Store a user need with TTL and publish to Redis
+    Secondary index values maintained alongside a need record
     """
-    # Ensure the user actually exists
-    if not r.sismember(USERS_SET, user_id):
-        raise ValueError(f"Cannot create need: user '{user_id}' is not registered.")
-        
-    need = {
-        "need_id": f"need_{user_id}_{int(datetime.utcnow().timestamp())}",
+    return {
+        "user_id":      need.get("user_id"),
+        "product_id":   need.get("product_id"),
+        "product_name": need.get("product_name"),
+    }
+
+
+# ─── Atomic need scripts ─────────────────────────────────────────────────────
+# Creating and removing a need each touch several keys; running them as one
+# server-side script makes each a single atomic round trip, so e.g. two match
+# workers can never both "remove" (and count) the same need.
+
+def _create_need_local(store, keys, args):
+    users, record, stream, by_time, *indexes = keys
+    user_id, need_id, ttl, maxlen, payload, storage, created_ts, *fields = args
+    if not store.sismember(users, user_id):
+        return 0
+    if storage == "hash":
+        store.delete(record)
+        store.hset(record, items=fields)
+        store.expire(record, int(ttl))
+    else:
+        store.set(record, payload, ex=int(ttl))
+    for idx in indexes:
+        store.sadd(idx, need_id)
+    store.zadd(by_time, {need_id: float(created_ts)})
+    store.xadd(stream, {EVENT_FIELD: payload}, maxlen=int(maxlen))
+    return 1
+
+
+_create_need = register_script("create_need", """
+-- KEYS: users set, need record, event stream, by-time zset, index sets...
+-- ARGV: user id, need id, ttl, stream maxlen, payload, storage, created ts, field/value pairs...
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if ARGV[6] == 'hash' then
+    redis.call('DEL', KEYS[2])
+    redis.call('HSET', KEYS[2], unpack(ARGV, 8))
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+else
+    redis.call('SET', KEYS[2], ARGV[5], 'EX', ARGV[3])
+end
+for i = 5, #KEYS do
+    redis.call('SADD', KEYS[i], ARGV[2])
+end
+redis.call('ZADD', KEYS[4], ARGV[7], ARGV[2])
+redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[4], '*', 'data', ARGV[5])
+return 1
+""", _create_need_local)
+
+
+def _remove_need_local(store, keys, args):
+    record, satisfied, stream, by_time, *indexes = keys
+    need_id, maxlen, payload = args
+    if not store.delete(record):
+        return 0
+    for idx in indexes:
+        store.srem(idx, need_id)
+    store.zrem(by_time, need_id)
+    store.xadd(stream, {EVENT_FIELD: payload}, maxlen=int(maxlen))
+    store.sadd(satisfied, need_id)
+    return 1
+
+
+_remove_need = register_script("remove_need", """
+-- KEYS: need record, satisfied set, event stream, by-time zset, index sets...
+-- ARGV: need id, stream maxlen, payload
+if redis.call('DEL', KEYS[1]) == 0 then
+    return 0
+end
+for i = 5, #KEYS do
+    redis.call('SREM', KEYS[i], ARGV[1])
+end
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[2], '*', 'data', ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[1])
+return 1
+""", _remove_need_local)
+
+
+def _new_need(user_id, prefs, now):
+    """Base need record created at `now` (epoch seconds)."""
+    return {
+        "need_id": new_id("need"),
         "user_id": user_id,
         "preferences": prefs,
-        "timestamp": datetime.utcnow().isoformat()
+        "tag_mask": stored_tag_mask(prefs.get("tags")),
+        # naive UTC ISO string, as before; created_ts is true epoch seconds
+        "timestamp": datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None).isoformat(),
+        "created_ts": now,
     }
 
+
+def process_user_preferences(user_id, prefs, ttl=DEFAULT_NEED_TTL):
+    """
+    Store a user need with TTL and publish to Redis
+    """
+    need = _new_need(user_id, prefs, time.time())
+
     # If no product_id specified, pick a random product to satisfy the need
+    # (none while the catalog is empty)
     if "product_id" not in prefs:
-        products = get_current_products()
-        if products:
-            prod = random.choice(products)
-            pid = prod.get("product_id")
-            prefs["product_id"] = pid
-            # Stamp the need with product_id and name
-            need["product_id"] = pid
-            need["product_name"] = prod.get("attributes", {}).get("name")
-        else:
-            # No products available yet
-            need["product_id"] = None
-            need["product_name"] = None
-
-    # Handle when a specific product_id was requested
-    if "product_id" in prefs:
-        pid = prefs["product_id"]
-        need["product_id"] = pid
+        prod = random_product()
+        if prod:
+            prefs["product_id"] = prod.get("product_id")
+    else:
         # Pull the stored product record to grab its name
-        raw = r.get(f"product:{pid}")
-        if raw:
-            prod = json.loads(raw)
-            need["product_name"] = prod.get("attributes", {}).get("name")
-        else:
-            need["product_name"] = None
-
-    # Persist the need in Redis and publish to needs_stream
-    key = f"need:{need['need_id']}"
-    r.setex(key, ttl, json.dumps(need))
-    r.publish("needs_stream", json.dumps(need))
-    # ─── Metrics ───────────────────────────────────────────
-    # count how many needs have ever been requested
-    r.incr("metrics:needs_requested")
-    
+        prod = get_product(prefs["product_id"])
+    # Stamp the need with product_id and name
+    need["product_id"]   = prefs.get("product_id")
+    need["product_name"] = prod.get("attributes", {}).get("name") if prod else None
+
+    # One atomic script: check the user is registered, persist the need with
+    # its index entries and creation-time entry, and append it to needs_stream
+    payload = encode(need)
+    fields  = [x for pair in record_fields(need).items() for x in pair] if ENTITY_STORAGE == "hash" else []
+    created = _create_need(
+        keys=[USERS_SET, f"need:{need['need_id']}", NEEDS_STREAM, NEEDS_BY_TIME,
+              *index_keys("need", need_indexes(need))],
+        args=[user_id, need["need_id"], ttl, EVENT_STREAM_MAXLEN, payload, ENTITY_STORAGE,
+              need["created_ts"], *fields],
+    )
+    # Ensure the user actually exists
+    if not created:
+        raise ValueError(f"Cannot create need: user '{user_id}' is not registered.")
+    metrics.incr("needs_requested")
+
     return need
 
 
+def process_user_preferences_batch(requests, ttl=DEFAULT_NEED_TTL, products=None):
+    """
+    Store many needs at once from (user_id, prefs) pairs and publish them.
+    Users are checked with one SMISMEMBER (requests for unregistered users are
+    skipped), needs without a product_id pick one at random (from `products`
+    if given, else from the product registry in one SRANDMEMBER), products
+    are loaded in one batch, and writes go out in pipelined chunks of
+    NEED_BATCH_SIZE. Returns the needs created.
+    """
+    requests = list(requests)
+    if not requests:
+        return []
+    users      = list({user_id for user_id, _ in requests})
+    registered = {u for u, ok in zip(users, r.smismember(USERS_SET, users)) if ok}
+
+    unassigned = sum(1 for _, prefs in requests if "product_id" not in prefs)
+    if products is not None:
+        by_id = {p.get("product_id"): p for p in products}
+        picks = [random.choice(products).get("product_id") for _ in range(unassigned)] if products else []
+    else:
+        by_id = {}
+        picks = random_product_ids(unassigned)
+    wanted = ({prefs["product_id"] for _, prefs in requests if "product_id" in prefs} | set(picks)) - by_id.keys()
+    if wanted:
+        by_id.update((p["product_id"], p) for p in get_products(wanted))
+    picks = iter(picks)
+
+    now   = time.time()
+    needs = []
+    for user_id, prefs in requests:
+        if user_id not in registered:
+            continue
+        need = _new_need(user_id, prefs, now)
+        if "product_id" not in prefs:
+            pick = next(picks, None)
+            if pick is not None:
+                prefs["product_id"] = pick
+        prod = by_id.get(prefs.get("product_id"))
+        need["product_id"]   = prefs.get("product_id")
+        need["product_name"] = prod.get("attributes", {}).get("name") if prod else None
+        needs.append(need)
+
+    for start in range(0, len(needs), NEED_BATCH_SIZE):
+        chunk = needs[start:start + NEED_BATCH_SIZE]
+        with pipelined(transaction=False):
+            for need in chunk:
+                payload = save_object("need", need["need_id"], need, ttl=ttl, indexes=need_indexes(need))
+                r.zadd(NEEDS_BY_TIME, {need["need_id"]: need["created_ts"]})
+                publish_event(NEEDS_STREAM, payload)
+    metrics.incr("needs_requested", len(needs))
+    return needs
+
+
+def count_active_needs(ttl=DEFAULT_NEED_TTL):
+    """
+    Number of live needs created with `ttl`, in one ZCOUNT: index entries
+    younger than `ttl` seconds (older ones have expired; satisfied needs have
+    left the index). Needs that detect_unsatisfied flagged and took out of
+    the index while still live are not counted, so the count is exact when
+    its threshold is at least `ttl`.
+    """
+    return r.zcount(NEEDS_BY_TIME, f"({time.time() - ttl}", "+inf")
+
+
 def get_need(need_id):
     """
     Retrieve a specific need by its ID
     """
-    data = r.get(f"need:{need_id}")
-    return json.loads(data) if data else None
+    return get_object("need", need_id)
 
 
 def get_current_needs():
     """
     List all active (non-expired) needs
     """
-    needs = []
-    for key in r.keys("need:*"):
-        data = r.get(key)
-        if data:
-            needs.append(json.loads(data))
-    return needs
+    return list_objects("need")
 
 
-def remove_need(need_id):
+def find_needs(**criteria):
     """
-    Remove a need before TTL expires and notify
+    List active needs matching every indexed field given, e.g.
+    find_needs(user_id="user_001") or find_needs(product_name="Sofa Set")
     """
-    key = f"need:{need_id}"
-    if r.exists(key):
-        r.delete(key)
-        r.publish("needs_removed_stream", json.dumps({"need_id": need_id}))
-        # Mark this need as satisfied
-        r.sadd(SATISFIED_SET, need_id)
-        return True
-    return False
+    return find_objects("need", **criteria)
+
+
+def remove_need(need_id, need=None):
+    """
+    Remove a need before TTL expires and notify.
+    Delete, index cleanup, notification and marking it satisfied happen in one
+    atomic script, so only one caller ever gets True for a given need.
+    Pass the caller's loaded `need` to skip reading it back for its indexes.
+    """
+    if need is None:
+        need = get_need(need_id)
+        if need is None:
+            return False
+    removed = _remove_need(
+        keys=[f"need:{need_id}", SATISFIED_SET, NEEDS_REMOVED_STREAM, NEEDS_BY_TIME,
+              *index_keys("need", need_indexes(need))],
+        args=[need_id, EVENT_STREAM_MAXLEN, encode({"need_id": need_id})],
+    )
+    return bool(removed)
 
 
 # Detect and publish unsatisfied needs
 def detect_unsatisfied(threshold_secs):
     """
-    Scan active needs older than threshold_secs that have not been satisfied,
-    mark them, and publish an unsatisfied event.
+    Flag live needs older than threshold_secs that have not been satisfied,
+    and publish an unsatisfied event for each; returns the flagged need ids.
+    Aged entries are read from the creation-time index and taken out of it
+    (satisfied needs already left it), so each need is considered once and
+    the cost follows the number of newly-aged needs. Entries whose need has
+    expired are dropped without an event.
     """
-    now_ts = datetime.utcnow().timestamp()
-    for need in get_current_needs():
-        nid = need["need_id"]
-        # Skip if already satisfied or already flagged unsatisfied
-        if r.sismember(SATISFIED_SET, nid) or r.sismember(UNSATISFIED_SET, nid):
-            continue
-        created_ts = datetime.fromisoformat(need["timestamp"]).timestamp()
-        if now_ts - created_ts > threshold_secs:
-            # Mark and publish unsatisfied
-            r.sadd(UNSATISFIED_SET, nid)
-            r.publish(UNSATISFIED_STREAM, json.dumps({
-                "need_id": nid,
-                "age_s": round(now_ts - created_ts, 1)
-            }))
+    now_ts  = time.time()
+    cutoff  = now_ts - threshold_secs
+    flagged = []
+    while True:
+        aged = r.zrangebyscore(NEEDS_BY_TIME, "-inf", f"({cutoff}", start=0,
+                               num=UNSATISFIED_BATCH, withscores=True)
+        if not aged:
+            return flagged
+
+        pipe = r.pipeline(transaction=False)
+        for nid, _ in aged:
+            pipe.exists(f"need:{nid}")
+        live = pipe.execute()
+
+        # ZREM decides which detector owns each need if several run at once
+        with pipelined(transaction=False) as batch:
+            for nid, _ in aged:
+                r.zrem(NEEDS_BY_TIME, nid)
+        owned = batch.results
+
+        with pipelined(transaction=False):
+            for (nid, created_ts), alive, mine in zip(aged, live, owned):
+                if not (alive and mine):
+                    continue
+                # Mark and publish unsatisfied
+                r.sadd(UNSATISFIED_SET, nid)
+                publish_event(UNSATISFIED_STREAM, encode({
+                    "need_id": nid,
+                    "age_s": round(now_ts - created_ts, 1)
+                }))
+                flagged.append(nid)
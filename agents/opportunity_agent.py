@@ -1,18 +1,21 @@
-import os
-import redis
-import json
-import random
 from datetime import datetime
 
-from agents.supplier_agent import get_current_products
+from agents.supplier_agent import get_product, count_products
+from agents.tags import stored_tag_mask
 from provider_manager import list_providers
+from db.client import get_client, pipelined
+from db.events import publish_event, EVENT_FIELD, EVENT_STREAM_MAXLEN
+from db.ids import new_id
+from db.redis_store import (
+    list_objects, save_object, find_objects, get_object, encode,
+    update_fields, index_keys,
+)
+from db.scripts import register_script
 
 from typing import Optional
 
-# Redis connection setup (reads from environment)
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+# Shared pooled Redis client (connection settings live in db/client.py)
+r = get_client()
 
 # Default Time-To-Live (TTL) for active offers, in seconds
 DEFAULT_OFFER_TTL = 10
@@ -31,61 +34,155 @@ MERCHANT_CATEGORIES = {
     # merchants not listed here can offer any category
 }
 
-# Redis set key prefix for each merchant’s stock of supplier products
+# Redis set key prefix for each merchant’s stock of supplier products.
+# A stock set is the merchant's offer pool: it only ever receives products
+# the merchant may offer (see merchant_accepts), so offers are sampled from
+# it directly with SRANDMEMBER.
 MERCHANT_STOCK_PREFIX = "merchant_stock:"
+# Merchants whose stock set is non-empty
+STOCKED_MERCHANTS_SET = "merchants:with_stock"
+# Random picks tried by generate_offer before giving up
+OFFER_PICK_ATTEMPTS   = 5
+
+# Event streams for offer lifecycle
+OFFERS_STREAM         = "offers_stream"
+OFFERS_REMOVED_STREAM = "offers_removed_stream"
+PENDING_OFFERS_STREAM = "pending_offers_stream"
+
+
+def merchant_accepts(merchant_id: str, category: Optional[str]) -> bool:
+    """Whether the merchant's specialization (if any) covers `category`."""
+    allowed = MERCHANT_CATEGORIES.get(merchant_id)
+    return not allowed or category in allowed
+
+
+def offer_indexes(offer: dict) -> dict:
+    """
+    Secondary index values maintained alongside an offer record.
+    """
+    return {
+        "product_id":   offer.get("product_id"),
+        "product_name": offer.get("product_name"),
+        "merchant":     offer.get("provided_by"),
+        "category":     offer.get("category"),
+    }
+
+
+# ─── Atomic offer scripts ────────────────────────────────────────────────────
+# Like the need scripts in needs_agent: each check-and-write runs server-side
+# as one atomic round trip, so concurrent callers cannot interleave.
+
+def _remove_offer_local(store, keys, args):
+    record, stream, *indexes = keys
+    offer_id, maxlen, payload = args
+    if not store.delete(record):
+        return 0
+    for idx in indexes:
+        store.srem(idx, offer_id)
+    store.xadd(stream, {EVENT_FIELD: payload}, maxlen=int(maxlen))
+    return 1
+
+
+_remove_offer = register_script("remove_offer", """
+-- KEYS: offer record, event stream, index sets...
+-- ARGV: offer id, stream maxlen, payload
+if redis.call('DEL', KEYS[1]) == 0 then
+    return 0
+end
+for i = 3, #KEYS do
+    redis.call('SREM', KEYS[i], ARGV[1])
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'data', ARGV[3])
+return 1
+""", _remove_offer_local)
+
+
+def _unstock_if_empty_local(store, keys, args):
+    stock, stocked = keys
+    merchant, = args
+    if store.scard(stock):
+        return 0
+    return store.srem(stocked, merchant)
+
+
+# A stock worker may refill the merchant between our empty SRANDMEMBER and
+# the SREM; checking inside the script keeps the refilled merchant listed
+_unstock_if_empty = register_script("unstock_if_empty", """
+-- KEYS: merchant stock set, stocked-merchants set
+-- ARGV: merchant id
+if redis.call('SCARD', KEYS[1]) > 0 then
+    return 0
+end
+return redis.call('SREM', KEYS[2], ARGV[1])
+""", _unstock_if_empty_local)
+
+
+def _pick_from_stock(merchant: str) -> Optional[dict]:
+    """A usable product sampled from the merchant's stock pool, or None."""
+    stock_key = f"{MERCHANT_STOCK_PREFIX}{merchant}"
+    for _ in range(OFFER_PICK_ATTEMPTS):
+        product_id = r.srandmember(stock_key)
+        if product_id is None:
+            _unstock_if_empty(keys=[stock_key, STOCKED_MERCHANTS_SET], args=[merchant])
+            return None  # merchant has no inventory
+        product = get_product(product_id)
+        if product is None or not merchant_accepts(merchant, product.get("attributes", {}).get("category")):
+            r.srem(stock_key, product_id)
+            continue
+        return product
+    return None
+
+
+def _pick_stocked_product(agent_id: Optional[str]):
+    """
+    (merchant, product) sampled from the stock pools, or None. Without an
+    `agent_id`, up to OFFER_PICK_ATTEMPTS distinct registered merchants with
+    stock are tried in random order. Pool entries found stale (missing
+    product, or outside the merchant's specialization) and merchants found
+    unregistered or without stock are cleaned up as they are drawn, so they
+    cannot crowd out merchants that do have stock.
+    """
+    if agent_id is not None:
+        product = _pick_from_stock(agent_id)
+        return (agent_id, product) if product is not None else None
+
+    providers = set(list_providers())
+    tried     = set()
+    while len(tried) < OFFER_PICK_ATTEMPTS:
+        drawn = [m for m in r.srandmember(STOCKED_MERCHANTS_SET, OFFER_PICK_ATTEMPTS) if m not in tried]
+        if not drawn:
+            return None
+        for merchant in drawn:
+            if merchant not in providers:
+                r.srem(STOCKED_MERCHANTS_SET, merchant)
+                continue
+            tried.add(merchant)
+            product = _pick_from_stock(merchant)
+            if product is not None:
+                return merchant, product
+    return None
 
 
 def generate_offer(agent_id:Optional[str], strategy: str="", ttl: int = DEFAULT_OFFER_TTL) -> Optional[dict]:
     """
-    Generate a new active offer for a merchant by randomly choosing
-    from that merchant’s stocked supplier products, apply specialization
-    filters, persist with TTL, and publish to 'offers_stream'.
+    Generate a new active offer for a merchant (a random registered merchant
+    with stock when `agent_id` is None) by sampling one product from its
+    stock pool, persist with TTL, and publish to 'offers_stream'.
+    A few SRANDMEMBERs and one cached product read, whatever the stock size.
     """
 
     # If no products have been created yet, skip generating offers
-    if not get_current_products():
+    if not count_products():
         return None
 
-    if agent_id is None:
-        # grab all registered merchants
-        all_merchants = list_providers()
-        # filter to those who actually have stock
-        stocked = [m for m in all_merchants if list_stocked_products(m)]
-        if not stocked:
-            return None  # no one has stock right now
-        agent_id = random.choice(stocked)
-
-    # 1) Load this merchant’s stocked product IDs
-    stock_key   = f"{MERCHANT_STOCK_PREFIX}{agent_id}"
-    stocked_ids = r.smembers(stock_key)
-    if not stocked_ids:
-        return None  # merchant has no inventory
-
-    # 2) Fetch each stocked product record from Redis
-    products = []
-    for pid in stocked_ids:
-        raw = r.get(f"product:{pid}")
-        if raw:
-            products.append(json.loads(raw))
-    if not products:
-        return None  # no valid product data
-
-    # 3) Apply merchant specialization filter if defined
-    allowed = MERCHANT_CATEGORIES.get(agent_id)
-    if allowed:
-        products = [
-            p for p in products
-            if p.get("attributes", {}).get("category") in allowed
-        ]
-        if not products:
-            return None  # none match their category specialism
-
-    # 4) Choose one at random
-    product = random.choice(products)
+    picked = _pick_stocked_product(agent_id)
+    if picked is None:
+        return None  # no one (or not this merchant) has usable stock
+    agent_id, product = picked
 
     # 5) Build a “flattened” offer payload
     attrs = product.get("attributes", {})
-    offer_id = f"offer_{agent_id}_{int(datetime.utcnow().timestamp())}"
+    offer_id = new_id("offer")
     offer = {
         "offer_id":    offer_id,
         "provided_by": agent_id,
@@ -95,16 +192,17 @@ def generate_offer(agent_id:Optional[str], strategy: str="", ttl: int = DEFAULT_
         "supplier_id": product.get("supplier_id"),
         "category":    attrs.get("category"),
         "tags":        attrs.get("tags", []),
+        "tag_mask":    stored_tag_mask(attrs.get("tags")),
         "price":       attrs.get("price"),
         "brand":       attrs.get("brand"),
         "strategy":    strategy,
         "timestamp":   datetime.utcnow().isoformat()
     }
 
-    # 6) Persist with TTL and publish
-    key = f"offer:{offer_id}"
-    r.setex(key, ttl, json.dumps(offer))
-    r.publish("offers_stream", json.dumps(offer))
+    # 6) Persist with TTL and index entries, then publish, in one MULTI/EXEC
+    with pipelined():
+        payload = save_object("offer", offer_id, offer, ttl=ttl, indexes=offer_indexes(offer))
+        publish_event(OFFERS_STREAM, payload)
     return offer
 
 
@@ -118,82 +216,125 @@ def stage_offer(agent_id: str, strategy: str, ttl: int = DEFAULT_OFFER_TTL) -> d
     if not offer:
         return None
 
-    r.set(f"pending_offer:{offer['offer_id']}", json.dumps(offer))
-    r.publish("pending_offers_stream", json.dumps(offer))
+    payload = encode(offer)
+    with pipelined():
+        r.set(f"pending_offer:{offer['offer_id']}", payload)
+        publish_event(PENDING_OFFERS_STREAM, payload)
     return offer
 
 
 def get_offer(offer_id: str) -> dict | None:
-    data = r.get(f"offer:{offer_id}")
-    return json.loads(data) if data else None
+    return get_object("offer", offer_id)
 
 
 def get_current_offers() -> list[dict]:
-    offers = []
-    for key in r.keys("offer:*"):
-        raw = r.get(key)
-        if raw:
-            offers.append(json.loads(raw))
-    return offers
+    return list_objects("offer")
+
+
+def find_offers(**criteria) -> list[dict]:
+    """
+    List live offers matching every indexed field given, e.g.
+    find_offers(product_id=pid) or find_offers(merchant="merchant_books").
+    """
+    return find_objects("offer", **criteria)
 
 
 def remove_offer(offer_id: str) -> bool:
-    key = f"offer:{offer_id}"
-    if r.exists(key):
-        r.delete(key)
-        r.publish("offers_removed_stream", json.dumps({"offer_id": offer_id}))
-        return True
-    return False
-
-
-def adjust_offer_price(offer_id: str, new_price: float, ttl: int = DEFAULT_OFFER_TTL) -> dict | None:
-    key = f"offer:{offer_id}"
-    raw = r.get(key)
-    if not raw:
+    """
+    Delete an offer, drop it from its indexes and announce the removal, in one
+    atomic script (run immediately, even inside a pipelined() block). Only the
+    caller that actually deleted the record gets True and publishes.
+    """
+    offer = get_offer(offer_id)
+    if offer is None:
+        return False
+    removed = _remove_offer(
+        keys=[f"offer:{offer_id}", OFFERS_REMOVED_STREAM, *index_keys("offer", offer_indexes(offer))],
+        args=[offer_id, EVENT_STREAM_MAXLEN, encode({"offer_id": offer_id})],
+    )
+    return bool(removed)
+
+
+def adjust_offer_price(offer_id: str, new_price: float, ttl: int = DEFAULT_OFFER_TTL,
+                       offer: Optional[dict] = None) -> dict | None:
+    """
+    Atomically update an offer's price and timestamp (refreshing its TTL)
+    without rewriting the rest of the record, then publish the updated offer.
+    Pass the caller's already-loaded `offer` to skip re-reading it.
+    """
+    changes = {"price": new_price, "timestamp": datetime.utcnow().isoformat()}
+    if not update_fields("offer", offer_id, changes, ttl=ttl):
         return None
-    offer = json.loads(raw)
-    offer["price"]     = new_price
-    offer["timestamp"] = datetime.utcnow().isoformat()
-    r.setex(key, ttl, json.dumps(offer))
-    r.publish("offers_stream", json.dumps(offer))
+    offer = {**offer, **changes} if offer is not None else get_offer(offer_id)
+    if offer is None:
+        return None  # expired right after the update
+    publish_event(OFFERS_STREAM, encode(offer))
     return offer
 
 
-def negotiate_price(need: dict, offer: dict) -> dict:
-    price     = offer.get("price", 0)
-    max_price = need.get("preferences", {}).get("price_max", 0)
-    strategy  = offer.get("strategy", "neutral")
+# How far above the buyer's price_max each strategy still makes a
+# counter-offer; other strategies accept or reject outright
+COUNTER_OFFER_MARGINS = {
+    "match_score":  25,
+    "budget_focus": 15,
+}
+
 
-    if strategy == "match_score":
-        if price <= max_price:
-            status = "accepted"
-        elif price - max_price <= 25:
-            status = "counter-offer"
-        else:
-            status = "rejected"
-    elif strategy == "budget_focus":
-        if price <= max_price:
-            status = "accepted"
-        elif price - max_price <= 15:
-            status = "counter-offer"
-        else:
-            status = "rejected"
-    elif strategy == "high_margin":
-        status = "accepted" if price <= max_price else "rejected"
-    else:
-        status = "accepted" if price <= max_price else "rejected"
+def negotiation_status(price, max_price, strategy) -> str:
+    if price <= max_price:
+        return "accepted"
+    margin = COUNTER_OFFER_MARGINS.get(strategy)
+    if margin is not None and price - max_price <= margin:
+        return "counter-offer"
+    return "rejected"
 
+
+def negotiation_outcome(need: dict, offer: dict, status: str) -> dict:
+    """Negotiation record for a pair whose status is already known."""
     return {
-        "offered_price":  price,
-        "max_user_price": max_price,
+        "offered_price":  offer.get("price", 0),
+        "max_user_price": need.get("preferences", {}).get("price_max", 0),
         "status":         status,
-        "strategy":       strategy,
+        "strategy":       offer.get("strategy", "neutral"),
         "agent_id":       offer.get("provided_by")
     }
 
 
+def negotiate_price(need: dict, offer: dict) -> dict:
+    price     = offer.get("price", 0)
+    max_price = need.get("preferences", {}).get("price_max", 0)
+    strategy  = offer.get("strategy", "neutral")
+    return negotiation_outcome(need, offer, negotiation_status(price, max_price, strategy))
+
+
 def stock_product(merchant_id: str, product_id: str) -> bool:
-    return r.sadd(f"{MERCHANT_STOCK_PREFIX}{merchant_id}", product_id) == 1
+    """Stock one product, if the merchant's specialization accepts it."""
+    product = get_product(product_id)
+    if product is None or not merchant_accepts(merchant_id, product.get("attributes", {}).get("category")):
+        return False
+    added = r.sadd(f"{MERCHANT_STOCK_PREFIX}{merchant_id}", product_id)
+    r.sadd(STOCKED_MERCHANTS_SET, merchant_id)
+    return added == 1
+
+
+def stock_products(merchant_id: str, product_ids) -> int:
+    """
+    Stock several products with one multi-member SADD; returns how many were
+    new (nothing useful when queued in a pipelined() block). Callers pass only
+    products the merchant accepts (merchant_stock_worker routes them by
+    category).
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    # Stock first: a merchant in STOCKED_MERCHANTS_SET always has stock to draw
+    added = r.sadd(f"{MERCHANT_STOCK_PREFIX}{merchant_id}", *product_ids)
+    r.sadd(STOCKED_MERCHANTS_SET, merchant_id)
+    return added
+
+
+def count_stocked_merchants() -> int:
+    return r.scard(STOCKED_MERCHANTS_SET)
 
 
 def list_stocked_products(merchant_id: str) -> list[str]:
@@ -201,12 +342,8 @@ def list_stocked_products(merchant_id: str) -> list[str]:
 
 
 def list_merchant_products(merchant_id: str) -> list[str]:
-    offers = get_current_offers()
-    products = {
-        o.get("product_id")
-        for o in offers
-        if o.get("provided_by") == merchant_id
-    }
+    offers = find_offers(merchant=merchant_id)
+    products = {o.get("product_id") for o in offers}
     return list(products)
 
 
@@ -0,0 +1,165 @@
+# agents/score_pool.py
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from agents.insight_agent import MatchFeatures, SCORE_BLOCK_CELLS
+from agents.opportunity_agent import COUNTER_OFFER_MARGINS
+
+# Multi-core first-offer selection for a match cycle.
+# The need/offer features are packed into NumPy arrays once, copied into
+# shared memory, and worker processes score and negotiate contiguous chunks
+# of needs straight from those buffers, so no need or offer dict is ever
+# pickled. Small batches (or SCORE_POOL_SIZE=0) run the same kernel in-process.
+
+SCORE_POOL_SIZE      = int(os.getenv("SCORE_POOL_SIZE", 0))         # worker processes; 0 = in-process only
+SCORE_POOL_MIN_NEEDS = int(os.getenv("SCORE_POOL_MIN_NEEDS", 5000))  # smaller cycles stay in-process
+SCORE_POOL_CHUNK     = int(os.getenv("SCORE_POOL_CHUNK", 2000))      # needs per task
+
+# Negotiation status codes in the `status` result array
+NO_MATCH, REJECTED, ACCEPTED, COUNTER_OFFER = -1, 0, 1, 2
+STATUS_NAMES = {REJECTED: "rejected", ACCEPTED: "accepted", COUNTER_OFFER: "counter-offer"}
+
+_pool      = None
+_pool_lock = threading.Lock()
+
+
+def pack_features(needs, offers):
+    """
+    Arrays consumed by the kernel: the scoring features plus the offer's
+    asking price and counter-offer margin (-1 = never counters), and the
+    offers sorted by product name so a name's offers are one slice.
+    """
+    f = MatchFeatures(needs, offers)
+    arrays = {name: getattr(f, name) for name in MatchFeatures.ARRAYS}
+    arrays["offer_ask"] = np.array([o.get("price", 0) or 0 for o in offers], dtype=np.float64)
+    arrays["offer_margin"] = np.array(
+        [COUNTER_OFFER_MARGINS.get(o.get("strategy", "neutral"), -1) for o in offers],
+        dtype=np.float64,
+    )
+    arrays["offer_order"] = np.argsort(f.offer_name, kind="stable")
+    return arrays
+
+
+def negotiation_codes(ask, cap, margin):
+    """Vectorised opportunity_agent.negotiation_status, as status codes."""
+    return np.where(
+        ask <= cap, ACCEPTED,
+        np.where((margin >= 0) & (ask - cap <= margin), COUNTER_OFFER, REJECTED),
+    ).astype(np.int8)
+
+
+def best_offer_chunk(arrays, start, stop):
+    """
+    For needs start..stop-1, pick the first offer (in offer order) with a
+    positive score that passes the tag pre-filter, as run_match_cycle does,
+    and negotiate it. Returns (offer_index, score, status) arrays for the
+    chunk; offer_index is -1 and status NO_MATCH where nothing matched.
+    """
+    f = MatchFeatures.from_arrays(arrays)
+    order        = arrays["offer_order"]
+    sorted_names = f.offer_name[order]
+
+    n = stop - start
+    best   = np.full(n, -1, dtype=np.int64)
+    score  = np.zeros(n, dtype=np.float64)
+    status = np.full(n, NO_MATCH, dtype=np.int8)
+
+    rows_all = np.arange(start, stop)
+    names = f.need_name[start:stop]
+    for code in np.unique(names[names >= 0]):
+        lo, hi = np.searchsorted(sorted_names, [code, code + 1])
+        if lo == hi:
+            continue
+        cols = order[lo:hi]  # ascending offer index (stable sort)
+        rows = rows_all[names == code]
+        step = max(1, SCORE_BLOCK_CELLS // len(cols))
+        for s in range(0, len(rows), step):
+            r = rows[s:s + step]
+            block = f.scores(r, cols)
+            ok = (block > 0) & f.tag_overlap(r, cols)
+            hit = ok.any(axis=1)
+            first = ok.argmax(axis=1)[hit]
+            out, c = r[hit] - start, cols[first]
+            best[out]  = c
+            score[out] = block[hit, first]
+            r = r[hit]
+            status[out] = negotiation_codes(arrays["offer_ask"][c], f.price_max[r], arrays["offer_margin"][c])
+    return best, score, status
+
+
+# ─── Shared-memory fan-out ───────────────────────────────────────────────────
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13: pool processes share our resource tracker,
+        return shared_memory.SharedMemory(name=name)  # so re-registering is a no-op
+
+
+def _pool_task(specs, start, stop):
+    """Worker-process entry point: map the shared arrays and run one chunk."""
+    segments = {key: _attach(name) for key, (name, _, _) in specs.items()}
+    try:
+        arrays = {
+            key: np.ndarray(shape, dtype=dtype, buffer=segments[key].buf)
+            for key, (_, shape, dtype) in specs.items()
+        }
+        return best_offer_chunk(arrays, start, stop)
+    finally:
+        arrays = None
+        for shm in segments.values():
+            shm.close()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: forking a process that runs threads is unsafe
+                _pool = ProcessPoolExecutor(max_workers=SCORE_POOL_SIZE, mp_context=get_context("spawn"))
+    return _pool
+
+
+def _run_in_pool(arrays, n_needs):
+    segments, specs = [], {}
+    try:
+        for key, arr in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            segments.append(shm)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            specs[key] = (shm.name, arr.shape, arr.dtype.str)
+        pool = get_pool()
+        futures = [
+            pool.submit(_pool_task, specs, start, min(start + SCORE_POOL_CHUNK, n_needs))
+            for start in range(0, n_needs, SCORE_POOL_CHUNK)
+        ]
+        parts = [fut.result() for fut in futures]
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+    return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+
+def best_offers(needs, offers):
+    """
+    First usable offer, its score and negotiation status for every need, as
+    aligned arrays indexed like `needs` (see best_offer_chunk). Runs on the
+    process pool when SCORE_POOL_SIZE > 0 and the batch is large enough,
+    in-process otherwise (including when tags exceed a 64-bit mask).
+    """
+    arrays = pack_features(needs, offers)
+    use_pool = (
+        SCORE_POOL_SIZE > 0
+        and len(needs) >= max(SCORE_POOL_MIN_NEEDS, 1)
+        and arrays["need_tags"].dtype != object
+    )
+    if use_pool:
+        return _run_in_pool(arrays, len(needs))
+    return best_offer_chunk(arrays, 0, len(needs))
@@ -1,12 +1,18 @@
 import os
-import redis
-import json
 from datetime import datetime
 
+from db.redis_store import (
+    list_objects, save_object, find_objects, get_object, get_objects, index_key, index_keys,
+    iter_objects, SCAN_BATCH_SIZE,
+)
+from db.client import get_client, pipelined
+from db.cache import register_cache, watch_stream
+from db.events import publish_event
+from db.ids import new_id
+from analytics import metrics
+
 # Redis connection
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+r = get_client()
 
 # Redis set key for tracking registered suppliers
 SUPPLIERS_SET = "suppliers"
@@ -14,6 +20,29 @@ SUPPLIERS_SET = "suppliers"
 # Stream name for new products
 PRODUCTS_STREAM = "products_stream"
 
+# Product-id registry: every product id, for SRANDMEMBER/SCARD without a
+# catalog scan. Per-category registries are the category index sets.
+PRODUCTS_SET = "products:all"
+
+# Products never change after creation, so reads are served from an
+# in-process LRU; a product event for a cached id evicts it
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 10000))
+product_cache = register_cache("products", maxsize=PRODUCT_CACHE_SIZE)
+
+
+def _on_product_event(product):
+    product_cache.invalidate(product.get("product_id"))
+
+
+def product_indexes(product):
+    """Secondary index values maintained alongside a product record."""
+    attrs = product.get("attributes", {})
+    return {
+        "product_name": attrs.get("name"),
+        "category":     attrs.get("category"),
+        "supplier_id":  product.get("supplier_id"),
+    }
+
 
 def register_supplier(supplier_id):
     """Register a new supplier ID into the system."""
@@ -30,32 +59,107 @@ def generate_product(supplier_id, attrs):
     Create a new product with attributes and publish to Redis.
     attrs should be a dict with keys like 'name', 'category', 'price', etc.
     """
-    timestamp = int(datetime.utcnow().timestamp())
-    product_id = f"product_{supplier_id}_{timestamp}"
+    product_id = new_id("product")
     product = {
         "product_id": product_id,
         "supplier_id": supplier_id,
         "attributes": attrs,
         "timestamp": datetime.utcnow().isoformat()
     }
-    # Persist product indefinitely
-    key = f"product:{product_id}"
-    r.set(key, json.dumps(product))
-    # Publish an event on the products stream
-    r.publish(PRODUCTS_STREAM, json.dumps(product))
-    # ─── Metrics ─────────────────────────────────────────────────────────────
-    # count how many products have been created
-    r.incr("metrics:products_created")
-    # count product publications
-    r.incr("metrics:products_streamed")
+    # Record, index entries and event go out in one round trip
+    with pipelined():
+        # Persist product indefinitely, together with its index entries
+        payload = save_object("product", product_id, product, indexes=product_indexes(product))
+        r.sadd(PRODUCTS_SET, product_id)
+        # Publish an event on the products stream
+        publish_event(PRODUCTS_STREAM, payload)
+    # ─── Metrics (flushed in the background, see analytics/metrics.py) ────
+    # count how many products have been created and published
+    metrics.incr("products_created")
+    metrics.incr("products_streamed")
     return product
 
 
+def get_product(product_id):
+    """Retrieve one product, from the in-process cache when possible."""
+    watch_stream(PRODUCTS_STREAM, _on_product_event)
+    return product_cache.get_or_load(product_id, lambda: get_object("product", product_id))
+
+
+def get_products(product_ids):
+    """Retrieve several products, fetching only cache misses (in one batch)."""
+    watch_stream(PRODUCTS_STREAM, _on_product_event)
+    found, missing = [], []
+    for pid in product_ids:
+        product = product_cache.get(pid)
+        if product is None:
+            missing.append(pid)
+        else:
+            found.append(product)
+    for product in get_objects("product", missing):
+        product_cache.put(product["product_id"], product)
+        found.append(product)
+    return found
+
+
+def product_registry_key(category=None):
+    return index_key("product", "category", category) if category is not None else PRODUCTS_SET
+
+
+def count_products(category=None):
+    """Number of products (in `category`), in one SCARD."""
+    return r.scard(product_registry_key(category))
+
+
+def random_product_ids(k, category=None):
+    """`k` product ids drawn at random with replacement (empty if none)."""
+    if k <= 0:
+        return []
+    return r.srandmember(product_registry_key(category), -k)
+
+
+def random_product(category=None, attempts=3):
+    """A random product (in `category`), or None when there is none."""
+    for _ in range(attempts):
+        product_id = r.srandmember(product_registry_key(category))
+        if product_id is None:
+            return None
+        product = get_product(product_id)
+        if product is not None:
+            return product
+    return None
+
+
+def rebuild_product_registry():
+    """
+    Add every stored product to the registry and to its index sets, category
+    registries included (for data written before they existed).
+    """
+    total = 0
+    batch = []
+    for product in iter_objects("product"):
+        batch.append(product)
+        if len(batch) >= SCAN_BATCH_SIZE:
+            total += _register_products(batch)
+            batch = []
+    return total + _register_products(batch)
+
+
+def _register_products(products):
+    with pipelined(transaction=False):
+        for product in products:
+            product_id = product["product_id"]
+            r.sadd(PRODUCTS_SET, product_id)
+            for key in index_keys("product", product_indexes(product)):
+                r.sadd(key, product_id)
+    return len(products)
+
+
 def get_current_products():
     """Retrieve all stored products."""
-    products = []
-    for key in r.keys("product:*"):
-        data = r.get(key)
-        if data:
-            products.append(json.loads(data))
-    return products
\ No newline at end of file
+    return list_objects("product")
+
+
+def find_products(**criteria):
+    """List products matching every indexed field given, e.g. find_products(category="Books")."""
+    return find_objects("product", **criteria)
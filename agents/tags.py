@@ -0,0 +1,94 @@
+# agents/tags.py
+
+import threading
+
+from db.client import get_client
+
+# Tag interning.
+# Tags are mapped to bit positions so a set of tags is one integer mask and
+# the match pre-filter ("share at least one tag") is a single AND. The known
+# vocabulary has fixed bits below DYNAMIC_TAG_BASE; any other tag is given the
+# next free bit from DYNAMIC_TAG_BASE up through Redis so every process agrees
+# on it. Masks are persisted on needs and offers, so bit positions must never
+# change: only append to KNOWN_TAGS (at most DYNAMIC_TAG_BASE entries), which
+# cannot collide with bits already handed out to other tags.
+
+KNOWN_TAGS = [
+    "eco-friendly", "quiet", "budget", "fast-delivery",
+    "premium", "limited-edition", "new-arrival",
+]
+
+# First bit for tags outside KNOWN_TAGS. Dynamic tags are not capped, so masks
+# can grow past 64 bits, which msgpack cannot encode: stored_tag_mask() writes
+# such masks as hex strings and need_tag_mask()/offer_tag_mask() read both forms.
+DYNAMIC_TAG_BASE = 32
+MAX_INT_MASK     = (1 << 64) - 1   # largest mask stored as a plain integer
+if len(KNOWN_TAGS) > DYNAMIC_TAG_BASE:
+    raise RuntimeError("KNOWN_TAGS would overlap dynamically allocated tag bits")
+
+TAG_BITS_KEY     = "tags:bits"       # hash: tag -> bit, for tags outside KNOWN_TAGS
+TAG_NEXT_BIT_KEY = "tags:next_bit"   # counter handing out those bits
+
+_bits = {tag: bit for bit, tag in enumerate(KNOWN_TAGS)}
+_lock = threading.Lock()
+
+
+def tag_bit(tag):
+    bit = _bits.get(tag)
+    if bit is not None:
+        return bit
+    with _lock:
+        if tag in _bits:
+            return _bits[tag]
+        # Raw client: these must run now, even inside a pipelined() block
+        client = get_client().raw
+        bit = client.hget(TAG_BITS_KEY, tag)
+        if bit is None:
+            candidate = DYNAMIC_TAG_BASE + client.incr(TAG_NEXT_BIT_KEY) - 1
+            client.hsetnx(TAG_BITS_KEY, tag, candidate)
+            bit = client.hget(TAG_BITS_KEY, tag)  # another process may have won
+        _bits[tag] = int(bit)
+        return _bits[tag]
+
+
+def tag_mask(tags):
+    mask = 0
+    for tag in tags or ():
+        mask |= 1 << tag_bit(tag)
+    return mask
+
+
+def stored_tag_mask(tags):
+    """Mask of `tags` as persisted on records: an int, or hex once past 64 bits."""
+    mask = tag_mask(tags)
+    return mask if mask <= MAX_INT_MASK else hex(mask)
+
+
+def _loaded_mask(mask):
+    return int(mask, 16) if isinstance(mask, str) else mask
+
+
+def mask_bits(mask):
+    """Bit positions set in `mask`, lowest first."""
+    bit = 0
+    while mask:
+        if mask & 1:
+            yield bit
+        mask >>= 1
+        bit += 1
+
+
+def need_tag_mask(need):
+    """Stored mask of a need's preferred tags (computed for older records)."""
+    mask = need.get("tag_mask")
+    if mask is None:
+        return tag_mask(need.get("preferences", {}).get("tags", []))
+    return _loaded_mask(mask)
+
+
+def offer_tag_mask(offer):
+    """Stored mask of an offer's product tags (computed for older records)."""
+    mask = offer.get("tag_mask")
+    if mask is None:
+        return tag_mask(offer.get("product", {}).get("tags", []))
+    return _loaded_mask(mask)
@@ -0,0 +1,133 @@
+# agents/trace_log.py
+
+import atexit
+import os
+import threading
+import time
+
+from db.client import get_client, pipelined
+from db.redis_store import encode, decode
+from db.events import publish_event
+
+# Match-trace log.
+# Traces are buffered in-process and written by a background flusher in one
+# pipelined round trip per batch. Each trace lands in a per-user and a global
+# sorted set scored by its timestamp, so both are time-ordered and can be read
+# by time range, and both are trimmed on every flush to a maximum length and
+# age. Each trace is also appended to match_traces_stream for live viewers.
+# A failed flush puts its batch back at the front of the buffer; while Redis
+# is unreachable the buffer keeps the newest TRACE_BUFFER_MAX traces.
+
+TRACE_FLUSH_INTERVAL  = float(os.getenv("TRACE_FLUSH_INTERVAL", 0.5))   # seconds between flushes
+TRACE_FLUSH_BATCH     = int(os.getenv("TRACE_FLUSH_BATCH", 500))        # flush early at this many traces
+TRACE_RETENTION_USER  = int(os.getenv("TRACE_RETENTION_USER", 200))     # traces kept per user
+TRACE_RETENTION_ALL   = int(os.getenv("TRACE_RETENTION_ALL", 10000))    # traces kept globally
+TRACE_MAX_AGE         = float(os.getenv("TRACE_MAX_AGE", 24 * 3600))    # seconds
+TRACE_BUFFER_MAX      = int(os.getenv("TRACE_BUFFER_MAX", 50000))       # unflushed traces kept (oldest dropped)
+
+TRACES_STREAM    = "match_traces_stream"
+TRACES_ALL_KEY   = "match_traces:all"
+TRACES_USER_KEY  = "match_traces:user:{}"
+
+r = get_client()
+
+
+def trace_key(user_id=None):
+    return TRACES_USER_KEY.format(user_id) if user_id is not None else TRACES_ALL_KEY
+
+
+class TraceWriter:
+    def __init__(self):
+        self._buffer  = []
+        self._lock    = threading.Lock()
+        self._wake    = threading.Event()
+        self._thread  = None
+
+    def _trim(self):
+        # Called with the lock held
+        if len(self._buffer) > TRACE_BUFFER_MAX:
+            del self._buffer[:len(self._buffer) - TRACE_BUFFER_MAX]
+
+    def record(self, trace):
+        """Queue a trace for the next flush (starts the flusher on first use)."""
+        with self._lock:
+            self._buffer.append(trace)
+            self._trim()
+            full = len(self._buffer) >= TRACE_FLUSH_BATCH
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of traces written."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        try:
+            self._write(batch)
+        except Exception:
+            with self._lock:
+                self._buffer[:0] = batch
+                self._trim()
+            raise
+        return len(batch)
+
+    def _write(self, batch):
+        now = time.time()
+        users = set()
+        # MULTI/EXEC: a failed flush writes nothing, so retrying it duplicates nothing
+        with pipelined():
+            for trace in batch:
+                payload = encode(trace)
+                score   = trace.get("timestamp", now)
+                users.add(trace.get("user_id"))
+                r.zadd(trace_key(trace.get("user_id")), {payload: score})
+                r.zadd(TRACES_ALL_KEY, {payload: score})
+                publish_event(TRACES_STREAM, payload)
+            # Retention: newest N per key, nothing older than TRACE_MAX_AGE
+            cutoff = now - TRACE_MAX_AGE
+            for key, keep in [(trace_key(u), TRACE_RETENTION_USER) for u in users] + [(TRACES_ALL_KEY, TRACE_RETENTION_ALL)]:
+                r.zremrangebyrank(key, 0, -keep - 1)
+                r.zremrangebyscore(key, "-inf", f"({cutoff}")
+
+    def _run(self):
+        while True:
+            self._wake.wait(TRACE_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[traces] flush failed: {e}")
+
+
+trace_writer = TraceWriter()
+atexit.register(trace_writer.flush)
+
+
+def record_trace(trace):
+    trace_writer.record(trace)
+
+
+def read_traces(user_id=None, since=None, until=None, limit=None, newest_first=True):
+    """
+    Traces for one user (or all users) with since <= timestamp <= until,
+    newest first by default. Traces still buffered in this process are not
+    included until the next flush.
+    """
+    low  = since if since is not None else "-inf"
+    high = until if until is not None else "+inf"
+    start, num = (0, limit) if limit else (None, None)
+    if newest_first:
+        raw = r.zrevrangebyscore(trace_key(user_id), high, low, start=start, num=num)
+    else:
+        raw = r.zrangebyscore(trace_key(user_id), low, high, start=start, num=num)
+    traces = []
+    for payload in raw:
+        try:
+            traces.append(decode(payload))
+        except ValueError:
+            continue
+    return traces
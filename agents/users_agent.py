@@ -1,12 +1,10 @@
-import os
-import redis
-import json
 from datetime import datetime
+from db.client import get_client, pipelined
+from db.redis_store import encode
+from db.events import publish_event
 
-# Redis setup (same env vars you already use)
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+# Redis connection (shared pool, see db/client.py)
+r = get_client()
 
 USERS_STREAM = "users_stream"
 USERS_SET    = "users:all"
@@ -21,8 +19,9 @@ def create_user(user_id, attrs=None):
         "attrs":    attrs or {},
         "timestamp": datetime.utcnow().isoformat()
     }
-    r.publish(USERS_STREAM, json.dumps(user))
-    r.sadd(USERS_SET, user_id)
+    with pipelined():
+        publish_event(USERS_STREAM, encode(user))
+        r.sadd(USERS_SET, user_id)
     return user
 
 def list_users():
@@ -1,2 +1,245 @@
+import atexit
+import os
+import socket
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from db.client import get_client, pipelined
+
+# In-process metrics registry.
+# Counters, gauges and histograms are updated in memory (a dict update under
+# a lock) and a background flusher writes the accumulated deltas to Redis in
+# one pipeline every METRICS_FLUSH_INTERVAL seconds, or sooner once
+# METRICS_FLUSH_UPDATES updates are pending. Every value is labelled with the
+# worker that produced it:
+#   metrics:<name>                     counter total across workers (string)
+#   metrics:counters:<worker>          counter per worker (hash name -> value)
+#   metrics:gauges:<worker>            last gauge values (hash name -> value)
+#   metrics:hist:<name>:<worker>       histogram (hash bucket -> count, "sum", "count")
+#   metrics:workers                    workers by last flush time (sorted set)
+# Per-worker keys expire METRICS_RETENTION seconds after the worker's last
+# flush, and workers that old are trimmed from metrics:workers, so restarted
+# workers (new labels) do not pile up. A failed flush is merged back into the
+# buffers and retried on the next one.
+
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 1.0))  # seconds between flushes
+METRICS_FLUSH_UPDATES  = int(os.getenv("METRICS_FLUSH_UPDATES", 10000))   # flush early at this many updates
+METRICS_WORKER_TTL     = float(os.getenv("METRICS_WORKER_TTL", 300))      # workers silent this long are not read
+METRICS_RETENTION      = int(os.getenv("METRICS_RETENTION", 86400))       # per-worker keys outlive the last flush by this
+
+# Upper bounds (seconds) of the default histogram buckets; "+Inf" is implied
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+WORKERS_KEY  = "metrics:workers"
+TOTAL_KEY    = "metrics:{}"
+COUNTERS_KEY = "metrics:counters:{}"
+GAUGES_KEY   = "metrics:gauges:{}"
+HIST_KEY     = "metrics:hist:{}:{}"
+
+r = get_client()
+
+
+def default_worker():
+    """METRICS_WORKER, else <script>@<host>-<pid>."""
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+    return os.getenv("METRICS_WORKER") or f"{script}@{socket.gethostname()}-{os.getpid()}"
+
+
+class MetricsRegistry:
+    def __init__(self, worker=None):
+        self.worker   = worker or default_worker()
+        self._counters   = {}   # name -> delta since last flush
+        self._gauges     = {}   # name -> value set since last flush
+        self._histograms = {}   # name -> (buckets, counts, sum, count) since last flush
+        self._pending = 0
+        self._keys    = set()   # per-worker keys written so far (TTL refreshed on flush)
+        self._lock    = threading.Lock()
+        self._wake    = threading.Event()
+        self._thread  = None
+
+    def _updated(self):
+        # Called with the lock held
+        self._pending += 1
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+            self._thread.start()
+        if self._pending >= METRICS_FLUSH_UPDATES:
+            self._wake.set()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            self._updated()
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+            self._updated()
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = [tuple(buckets), [0] * (len(buckets) + 1), 0.0, 0]
+            hist[1][bisect_left(hist[0], value)] += 1
+            hist[2] += value
+            hist[3] += 1
+            self._updated()
+
+    def flush(self):
+        """Write everything accumulated so far in one pipeline; returns the number of updates."""
+        with self._lock:
+            counters, self._counters     = self._counters, {}
+            gauges, self._gauges         = self._gauges, {}
+            histograms, self._histograms = self._histograms, {}
+            pending, self._pending       = self._pending, 0
+        if not pending:
+            return 0
+
+        try:
+            self._write(counters, gauges, histograms)
+        except Exception:
+            self._restore(counters, gauges, histograms, pending)
+            raise
+        return pending
+
+    def _restore(self, counters, gauges, histograms, pending):
+        """Merge an unwritten batch back into the buffers (newer gauge values win)."""
+        with self._lock:
+            for name, delta in counters.items():
+                self._counters[name] = self._counters.get(name, 0) + delta
+            for name, value in gauges.items():
+                self._gauges.setdefault(name, value)
+            for name, (buckets, counts, total, count) in histograms.items():
+                hist = self._histograms.get(name)
+                if hist is None or hist[0] != buckets:
+                    self._histograms[name] = [buckets, counts, total, count]
+                    continue
+                hist[1] = [a + b for a, b in zip(hist[1], counts)]
+                hist[2] += total
+                hist[3] += count
+            self._pending += pending
+
+    def _write(self, counters, gauges, histograms):
+        worker = self.worker
+        now    = time.time()
+        keys   = set()
+        # MULTI/EXEC: a failed flush applies nothing, so it can be retried whole
+        with pipelined():
+            for name, delta in counters.items():
+                if isinstance(delta, float):
+                    r.incrbyfloat(TOTAL_KEY.format(name), delta)
+                    r.hincrbyfloat(COUNTERS_KEY.format(worker), name, delta)
+                else:
+                    r.incrby(TOTAL_KEY.format(name), delta)
+                    r.hincrby(COUNTERS_KEY.format(worker), name, delta)
+            if counters:
+                keys.add(COUNTERS_KEY.format(worker))
+            if gauges:
+                r.hset(GAUGES_KEY.format(worker), mapping=gauges)
+                keys.add(GAUGES_KEY.format(worker))
+            for name, (buckets, counts, total, count) in histograms.items():
+                key = HIST_KEY.format(name, worker)
+                for bound, n in zip(list(buckets) + ["+Inf"], counts):
+                    if n:
+                        r.hincrby(key, str(bound), n)
+                r.hincrbyfloat(key, "sum", total)
+                r.hincrby(key, "count", count)
+                keys.add(key)
+            for key in self._keys | keys:
+                r.expire(key, METRICS_RETENTION)
+            r.zadd(WORKERS_KEY, {worker: now})
+            r.zremrangebyscore(WORKERS_KEY, "-inf", now - METRICS_RETENTION)
+        self._keys |= keys
+
+    def _run(self):
+        while True:
+            self._wake.wait(METRICS_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[metrics] flush failed: {e}")
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush)
+
+
+def incr(name, amount=1):
+    registry.incr(name, amount)
+
+
+def gauge(name, value):
+    registry.gauge(name, value)
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS):
+    registry.observe(name, value, buckets)
+
+
+# ─── Read API ──────────────────────────────────────────────────────────────────
+def _number(raw):
+    if raw is None:
+        return 0
+    value = float(raw)
+    return int(value) if value.is_integer() else value
+
+
+def list_workers(max_age=METRICS_WORKER_TTL):
+    """Workers that flushed metrics within the last `max_age` seconds."""
+    return list(r.zrangebyscore(WORKERS_KEY, time.time() - max_age, "+inf"))
+
+
+def read_counters(*names):
+    """Totals across workers, in one MGET: {name: value}."""
+    if not names:
+        return {}
+    return {name: _number(raw) for name, raw in zip(names, r.mget([TOTAL_KEY.format(n) for n in names]))}
+
+
+def read_counter(name):
+    return read_counters(name)[name]
+
+
+def _read_per_worker(key_format, workers):
+    workers = list_workers() if workers is None else workers
+    pipe = r.pipeline(transaction=False)
+    for worker in workers:
+        pipe.hgetall(key_format.format(worker))
+    return dict(zip(workers, pipe.execute()))
+
+
+def read_counters_by_worker(workers=None):
+    """{worker: {name: value}} for live workers (or the given ones)."""
+    return {w: {k: _number(v) for k, v in (h or {}).items()}
+            for w, h in _read_per_worker(COUNTERS_KEY, workers).items()}
+
+
+def read_gauges(workers=None):
+    """{worker: {name: last value}} for live workers (or the given ones)."""
+    return {w: {k: _number(v) for k, v in (h or {}).items()}
+            for w, h in _read_per_worker(GAUGES_KEY, workers).items()}
+
+
+def read_histogram(name, workers=None):
+    """
+    Histogram `name` merged over live workers (or the given ones):
+    {"buckets": {upper_bound: count}, "sum": total, "count": n}.
+    """
+    merged = {"buckets": {}, "sum": 0, "count": 0}
+    for hist in _read_per_worker(HIST_KEY.format(name, "{}"), workers).values():
+        for field, raw in (hist or {}).items():
+            if field in ("sum", "count"):
+                merged[field] += _number(raw)
+            else:
+                merged["buckets"][field] = merged["buckets"].get(field, 0) + _number(raw)
+    merged["buckets"] = dict(sorted(merged["buckets"].items(),
+                                    key=lambda kv: float("inf") if kv[0] == "+Inf" else float(kv[0])))
+    return merged
+
+
 def compute_trust(feedback_list):
     return sum(feedback_list)/len(feedback_list) if feedback_list else 0
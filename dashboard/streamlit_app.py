@@ -1,14 +1,12 @@
 # dashboard/streamlit_app.py
 
-import os
 import json
 import threading
 import time
 from queue import Queue
-from datetime import datetime
+from datetime import datetime, timezone
 
 import streamlit as st
-import redis
 import pandas as pd
 
 import random  # make sure this is imported near the top
@@ -17,8 +15,13 @@ from agents.needs_agent import process_user_preferences, get_current_needs
 from agents.opportunity_agent import generate_offer, get_current_offers, list_all_merchants_products
 from agents.users_agent import list_users
 from provider_manager import list_providers
-from agents.supplier_agent import get_current_products
+from agents.supplier_agent import get_current_products, get_product
 from provider_manager import register_provider
+from db.client import get_client
+from db.events import EventTail
+from db.cache import cache_stats, clear_caches
+from agents.trace_log import read_traces
+from analytics.metrics import read_counters
 
 # ───────────────────────────────────────────────────────────────────────────────
 # Streamlit & Redis Setup
@@ -27,9 +30,7 @@ st.set_page_config(layout="wide")
 st.title("Autonomous Agent Ecosystem Dashboard")
 
 # Redis connection
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+r = get_client()
 
 # ───────────────────────────────────────────────────────────────────────────────
 # Session State Initialization
@@ -56,31 +57,28 @@ for m in [
     register_provider(m)
 
 # ───────────────────────────────────────────────────────────────────────────────
-# Redis Pub/Sub Listener (background thread)
+# Redis Streams Listener (background thread)
 # ───────────────────────────────────────────────────────────────────────────────
 def redis_listener(queue):
-    pubsub = r.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe(
+    tail = EventTail(
         "needs_stream", "needs_removed_stream",
         "offers_stream", "offers_removed_stream",
         "match_traces_stream", "providers_stream",
         "needs_unsatisfied_stream", "products_stream"
     )
-    for msg in pubsub.listen():
-        if msg.get("type") != "message":
-            continue
+    while True:
         try:
-            payload = json.loads(msg["data"])
-        except json.JSONDecodeError:
-            payload = msg["data"]
-        channel = msg["channel"]
-        if isinstance(channel, bytes):
-            channel = channel.decode()
-        queue.put({
-            "timestamp": time.time(),
-            "channel": channel,
-            "data": payload
-        })
+            events = tail.read()
+        except Exception as e:
+            print(f"[dashboard] event read failed: {e}")
+            time.sleep(1)
+            continue
+        for event in events:
+            queue.put({
+                "timestamp": time.time(),
+                "channel": event.stream,
+                "data": event.payload
+            })
 
 if "listener_thread" not in st.session_state:
     threading.Thread(target=redis_listener, args=(event_queue,), daemon=True).start()
@@ -91,9 +89,10 @@ if "listener_thread" not in st.session_state:
 # ───────────────────────────────────────────────────────────────────────────────
 user_id = st.sidebar.text_input("User ID", "user_001", key="user_id_input")
 
-st.sidebar.metric("Needs requested", r.get("metrics:needs_requested") or 0)
-st.sidebar.metric("Needs satisfied", r.get("metrics:needs_met") or 0)
-st.sidebar.metric("Needs unsatisfied", r.get("metrics:needs_not_met") or 0)
+counters = read_counters("needs_requested", "needs_met", "needs_not_met")
+st.sidebar.metric("Needs requested", counters["needs_requested"])
+st.sidebar.metric("Needs satisfied", counters["needs_met"])
+st.sidebar.metric("Needs unsatisfied", counters["needs_not_met"])
 
  #-- Submit Random Need
 if st.sidebar.button("Submit Random Need", key="btn_submit_need"):
@@ -161,10 +160,15 @@ st.sidebar.markdown("---")  # visual separator
 if st.sidebar.button("Reset All Data", key="btn_reset_data"):
     # Flush every key in Redis
     r.flushdb()
+    clear_caches()
     # Clear the local event history
     st.session_state["events"] = []
     st.sidebar.success("All Redis data and event history have been reset.")
 
+# In-process product/provider cache effectiveness
+with st.sidebar.expander("Cache Stats"):
+    st.table(pd.DataFrame(cache_stats()).T)
+
 st.sidebar.subheader("Active Products")
 products = get_current_products()
 if products:
@@ -211,7 +215,8 @@ UNSAT_TTL = 10  # seconds threshold
 # Identify unsatisfied needs
 unsatisfied = []
 for need in active_needs:
-    created_ts = datetime.fromisoformat(need["timestamp"]).timestamp()
+    created_ts = need.get("created_ts") or \
+        datetime.fromisoformat(need["timestamp"]).replace(tzinfo=timezone.utc).timestamp()
     age = now_ts - created_ts
     # check if any match_trace shows it was accepted
     accepted = any(
@@ -270,9 +275,8 @@ if offers:
         tags = prod.get("tags")
         # Fallback: lookup the full product record by ID if missing
         if not pname or price is None:
-            raw = r.get(f"product:{o.get('product_id','')}")
-            if raw:
-                pobj = json.loads(raw)
+            pobj = get_product(o.get("product_id", ""))
+            if pobj:
                 attrs = pobj.get("attributes", {})
                 if not pname:
                     pname = attrs.get("name")
@@ -433,4 +437,23 @@ if 'Removed' not in df.columns:
 
 df['Removed'] = df['Removed'].replace('', False).fillna(False).astype(bool)
 
-st.table(df)
\ No newline at end of file
+st.table(df)
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Match Trace History (persisted trace log, by time range)
+# ───────────────────────────────────────────────────────────────────────────────
+st.header(f"Match Trace History — {user_id or 'all users'}")
+window_min = st.slider("Window (minutes)", 1, 60, 10, key="trace_window")
+history = read_traces(user_id or None, since=time.time() - window_min * 60, limit=50)
+if history:
+    st.table(pd.DataFrame([{
+        "Time":          datetime.fromtimestamp(t.get("timestamp", 0)).strftime("%H:%M:%S"),
+        "Need ID":       t.get("need_id"),
+        "Offer ID":      t.get("offer_id"),
+        "Score":         t.get("score"),
+        "Status":        t.get("negotiation", {}).get("status"),
+        "Offered Price": t.get("negotiation", {}).get("offered_price"),
+        "Removed":       t.get("need_removed"),
+    } for t in history]))
+else:
+    st.write("No match traces in this window")
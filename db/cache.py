@@ -0,0 +1,150 @@
+# db/cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+from db.events import EventTail
+
+# In-process read-through caches.
+# Each LRUCache is bounded and thread-safe. Owners register a handler per
+# event stream with watch_stream(); a daemon thread per stream lets the
+# handler evict entries as events arrive, so cached reads stay fresh without
+# leaving the process.
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with optional per-entry TTL (a safety
+    net for entries whose invalidation events could be missed).
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.name    = name
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self._data   = OrderedDict()  # key -> (value, expires_at)
+        self._lock   = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and (entry[1] is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not _MISSING:
+                del self._data[key]  # expired
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for `key`, calling loader() on a miss.
+        None results are not cached, so a later write is picked up.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def invalidate(self, key=_MISSING):
+        """Drop one key, or everything when called without a key."""
+        with self._lock:
+            if key is _MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size":      len(self._data),
+                "maxsize":   self.maxsize,
+                "hits":      self.hits,
+                "misses":    self.misses,
+                "evictions": self.evictions,
+                "hit_rate":  round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+_registry = {}   # cache name -> LRUCache
+_watchers = {}   # stream -> listener thread
+_handlers = {}   # stream -> handlers called for each event
+_lock     = threading.Lock()
+
+
+def register_cache(name, maxsize=1024, ttl=None):
+    cache = LRUCache(name, maxsize=maxsize, ttl=ttl)
+    with _lock:
+        _registry[name] = cache
+    return cache
+
+
+def cache_stats():
+    """Hit/miss/eviction counters for every registered cache, keyed by name."""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def clear_caches():
+    for cache in _registry.values():
+        cache.invalidate()
+
+
+def watch_stream(stream, handler):
+    """
+    Call handler(decoded_payload) for every event appended to `stream`.
+    The first call per stream fixes the tail position before returning, so
+    nothing appended afterwards is missed, and hands the tail to a daemon
+    thread; later calls add their handler (once) to the same listener, and
+    handlers run in the order they were added.
+    """
+    handlers = _handlers.get(stream)
+    if handlers is not None and handler in handlers:
+        return
+    with _lock:
+        handlers = _handlers.setdefault(stream, [])
+        if handler in handlers:
+            return
+        handlers.append(handler)
+        if stream in _watchers:
+            return
+        tail = EventTail(stream)
+        thread = threading.Thread(
+            target=_listen, args=(tail, stream),
+            name=f"cache-watch-{stream}", daemon=True,
+        )
+        _watchers[stream] = thread
+        thread.start()
+
+
+def _listen(tail, stream):
+    while True:
+        try:
+            if tail is None:
+                tail = EventTail(stream)
+            for event in tail.read():
+                for handler in list(_handlers[stream]):
+                    handler(event.payload)
+        except Exception as e:
+            # Events may have been missed while disconnected: start cold
+            print(f"[cache] {stream} listener error: {e}; clearing caches")
+            clear_caches()
+            tail = None
+            time.sleep(1)
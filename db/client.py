@@ -0,0 +1,142 @@
+# db/client.py
+
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import redis
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+
+# Read Redis connection info from env (set in docker-compose.yml)
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+# Storage backend: "redis" (default) or "memory" to keep all state inside this
+# process (single-node runs, tests, benchmarks); see db/memory.py
+STORE_BACKEND = os.getenv("STORE_BACKEND", "redis").lower()
+
+# Pool tuning: one pool per process, shared by every agent and worker module
+REDIS_MAX_CONNECTIONS       = int(os.getenv("REDIS_MAX_CONNECTIONS", 32))
+REDIS_POOL_TIMEOUT          = float(os.getenv("REDIS_POOL_TIMEOUT", 10))   # wait for a free connection
+REDIS_SOCKET_TIMEOUT        = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+REDIS_RETRIES               = int(os.getenv("REDIS_RETRIES", 3))
+
+# Commands that are queued on the active pipeline inside a pipelined() block.
+# Everything else (reads, pubsub, pipeline(), ...) runs on the client directly.
+WRITE_COMMANDS = frozenset({
+    "set", "setex", "psetex", "setnx", "mset", "getdel",
+    "delete", "unlink", "expire", "pexpire", "expireat", "persist",
+    "incr", "incrby", "incrbyfloat", "decr", "decrby",
+    "publish",
+    "sadd", "srem", "smove",
+    "hset", "hsetnx", "hdel", "hincrby", "hincrbyfloat",
+    "rpush", "lpush", "ltrim",
+    "zadd", "zrem", "zincrby", "zremrangebyscore", "zremrangebyrank",
+    "xadd", "xack", "xtrim", "xdel",
+})
+
+_lock   = threading.Lock()
+_client = None
+_current_batch = ContextVar("redis_batch", default=None)
+
+
+class Batch:
+    """
+    Handle yielded by pipelined(). `results` holds the replies of every queued
+    command once the outermost block has executed (None until then).
+    """
+
+    def __init__(self, pipe):
+        self.pipe    = pipe
+        self.results = None
+
+
+class AutoPipelineClient:
+    """
+    Proxy around the backend client (pooled redis.Redis or MemoryStore).
+    Outside a pipelined() block every call goes straight to Redis. Inside one,
+    write commands are queued on the block's pipeline (and so return the
+    pipeline, not a reply) and are sent together when the block exits; reads
+    still execute immediately and do not see the queued writes.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def raw(self):
+        """The underlying backend client, bypassing any active batch."""
+        return self._client
+
+    def __getattr__(self, name):
+        batch = _current_batch.get()
+        if batch is not None and name in WRITE_COMMANDS:
+            return getattr(batch.pipe, name)
+        return getattr(self._client, name)
+
+
+def _build_client():
+    if STORE_BACKEND == "memory":
+        from db.memory import MemoryStore
+        return MemoryStore()
+
+    pool = redis.BlockingConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=0,
+        decode_responses=True,
+        # Binary payloads (see db/redis_store.encode) survive the str round trip
+        encoding_errors="surrogateescape",
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        # Reconnect and replay a command when the connection drops or times out
+        retry=Retry(ExponentialBackoff(cap=2.0, base=0.05), REDIS_RETRIES),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def get_client():
+    """
+    Return the process-wide client for the configured STORE_BACKEND, creating
+    its connection pool (or in-process store) on first use.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = AutoPipelineClient(_build_client())
+    return _client
+
+
+@contextmanager
+def pipelined(transaction=True):
+    """
+    Batch every write issued through get_client() in this block into a single
+    round trip (MULTI/EXEC when `transaction` is true). Nested blocks join the
+    outermost one; nothing is sent if the block raises.
+    """
+    outer = _current_batch.get()
+    if outer is not None:
+        yield outer
+        return
+
+    batch = Batch(get_client().raw.pipeline(transaction=transaction))
+    token = _current_batch.set(batch)
+    try:
+        yield batch
+    except BaseException:
+        batch.pipe.reset()
+        raise
+    else:
+        batch.results = batch.pipe.execute()
+    finally:
+        _current_batch.reset(token)
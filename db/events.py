@@ -0,0 +1,187 @@
+# db/events.py
+
+import os
+import socket
+import time
+from typing import Any, NamedTuple
+
+from redis.exceptions import ResponseError
+
+from db.client import get_client, pipelined
+from db.redis_store import decode
+
+# Event bus on Redis Streams.
+# Every event is an entry appended to the stream named after its topic
+# ("needs_stream", "offers_stream", ...) with the encoded payload in one
+# field. Streams are capped (approximately) at EVENT_STREAM_MAXLEN entries.
+#
+# Two ways to read:
+#   EventConsumer - a consumer group: each event is handled by one member,
+#                   must be acknowledged, survives restarts (unacked entries
+#                   are redelivered to the same consumer and claimed from dead
+#                   ones after EVENT_CLAIM_IDLE_MS), and the group scales out.
+#   EventTail     - a broadcast reader that sees every event appended after it
+#                   was created (caches, matchers, dashboards); a slow reader
+#                   catches up instead of being disconnected.
+
+EVENT_STREAM_MAXLEN = int(os.getenv("EVENT_STREAM_MAXLEN", 10000))
+EVENT_READ_COUNT    = int(os.getenv("EVENT_READ_COUNT", 100))      # entries per read
+EVENT_BLOCK_MS      = int(os.getenv("EVENT_BLOCK_MS", 1000))       # block per read when idle
+EVENT_CLAIM_IDLE_MS = int(os.getenv("EVENT_CLAIM_IDLE_MS", 30000)) # reclaim entries unacked this long
+
+# Field holding the payload in every entry (also hard-coded in Lua scripts)
+EVENT_FIELD = "data"
+
+r = get_client()
+
+
+class Event(NamedTuple):
+    stream:  str
+    id:      str
+    payload: Any
+
+
+def publish_event(stream, payload):
+    """
+    Append an encoded payload to `stream`. Queued like any other write when
+    called inside a pipelined() block.
+    """
+    return r.xadd(stream, {EVENT_FIELD: payload}, maxlen=EVENT_STREAM_MAXLEN, approximate=True)
+
+
+def _entries(reply):
+    """Flatten an XREAD/XREADGROUP reply into (stream, id, raw payload)."""
+    for stream, entries in reply or ():
+        for entry_id, fields in entries:
+            yield stream, entry_id, (fields or {}).get(EVENT_FIELD)
+
+
+def _decode_entry(raw):
+    try:
+        return decode(raw)
+    except (ValueError, TypeError):
+        return None
+
+
+class EventTail:
+    """
+    Broadcast reader over one or more streams, starting after their current
+    last entry (or from the oldest retained entry with `from_start`).
+    Positions live in this object only, so a restarted process resumes from
+    "now"; pair it with a resync of state (as caches and matchers do).
+    """
+
+    def __init__(self, *streams, from_start=False):
+        self.positions = {s: "0-0" if from_start else self._last_id(s) for s in streams}
+
+    @staticmethod
+    def _last_id(stream):
+        last = r.xrevrange(stream, count=1)
+        return last[0][0] if last else "0-0"
+
+    def read(self, count=EVENT_READ_COUNT, block=EVENT_BLOCK_MS):
+        """Next batch of events (empty after `block` ms without any)."""
+        events = []
+        for stream, entry_id, raw in _entries(r.xread(self.positions, count=count, block=block)):
+            self.positions[stream] = entry_id
+            payload = _decode_entry(raw)
+            if payload is not None:
+                events.append(Event(stream, entry_id, payload))
+        return events
+
+
+def ensure_group(stream, group):
+    """Create the consumer group at the end of the stream if it does not exist."""
+    try:
+        r.xgroup_create(stream, group, id="$", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+class EventConsumer:
+    """
+    Member `consumer` of consumer group `group` on one or more streams.
+    read() first replays this consumer's own unacknowledged entries (e.g.
+    after a crash), periodically claims entries other consumers left
+    unacknowledged for EVENT_CLAIM_IDLE_MS, and otherwise reads new entries.
+    Call ack() once events are handled; undecodable entries are acked and
+    dropped.
+    """
+
+    def __init__(self, group, *streams, consumer=None):
+        self.group    = group
+        self.streams  = streams
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        for stream in streams:
+            ensure_group(stream, group)
+        self._backlog    = {s: "0-0" for s in streams}  # replay position in our own pending list
+        self._next_claim = 0.0
+
+    def _collect(self, entries):
+        events, dropped = [], []
+        for stream, entry_id, raw in entries:
+            payload = _decode_entry(raw)
+            if payload is None:
+                dropped.append(Event(stream, entry_id, None))
+            else:
+                events.append(Event(stream, entry_id, payload))
+        if dropped:
+            self.ack(dropped)
+        return events
+
+    def _read_backlog(self, count):
+        entries = list(_entries(r.xreadgroup(self.group, self.consumer, self._backlog, count=count)))
+        if not entries:
+            self._backlog = None
+            return []
+        for stream, entry_id, _ in entries:
+            self._backlog[stream] = entry_id
+        return self._collect(entries)
+
+    def _claim(self, count):
+        entries = []
+        for stream in self.streams:
+            reply = r.xautoclaim(stream, self.group, self.consumer,
+                                 min_idle_time=EVENT_CLAIM_IDLE_MS, start_id="0-0", count=count)
+            for entry_id, fields in reply[1]:
+                entries.append((stream, entry_id, (fields or {}).get(EVENT_FIELD)))
+        return self._collect(entries)
+
+    def read(self, count=EVENT_READ_COUNT, block=EVENT_BLOCK_MS):
+        """Next batch of events to handle (empty after `block` ms without any)."""
+        try:
+            return self._read(count, block)
+        except ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+            # Stream or group deleted (e.g. FLUSHDB): start over from its end
+            for stream in self.streams:
+                ensure_group(stream, self.group)
+            self._backlog = None
+            return []
+
+    def _read(self, count, block):
+        while self._backlog is not None:
+            events = self._read_backlog(count)
+            if events:
+                return events
+        if time.monotonic() >= self._next_claim:
+            self._next_claim = time.monotonic() + EVENT_CLAIM_IDLE_MS / 2000
+            events = self._claim(count)
+            if events:
+                return events
+        reply = r.xreadgroup(self.group, self.consumer, {s: ">" for s in self.streams},
+                             count=count, block=block)
+        return self._collect(_entries(reply))
+
+    def ack(self, events):
+        """Acknowledge handled events, in one round trip."""
+        by_stream = {}
+        for event in events:
+            by_stream.setdefault(event.stream, []).append(event.id)
+        if not by_stream:
+            return
+        with pipelined(transaction=False):
+            for stream, ids in by_stream.items():
+                r.xack(stream, self.group, *ids)
@@ -0,0 +1,94 @@
+# db/ids.py
+
+import os
+import threading
+import time
+
+from db.client import get_client
+
+# Time-ordered unique ids.
+# Each id packs, into 64 bits: milliseconds since ID_EPOCH_MS (42 bits),
+# a node number (10 bits) and a per-millisecond sequence (12 bits), written
+# as 16 hex digits, so ids sort (as strings and as numbers) by creation time
+# and a process can issue up to 4096 per millisecond. The node is taken from
+# ID_NODE or allocated from a shared counter on first use, once per process.
+
+ID_EPOCH_MS = 1_700_000_000_000   # 2023-11-14T22:13:20Z
+NODE_BITS   = 10
+SEQ_BITS    = 12
+MAX_NODE    = (1 << NODE_BITS) - 1
+MAX_SEQ     = (1 << SEQ_BITS) - 1
+ID_WIDTH    = 16                  # hex digits
+
+NODE_COUNTER = "ids:next_node"
+
+r = get_client()
+
+
+class IdGenerator:
+    def __init__(self, node=None):
+        self._node    = node
+        self._last_ms = -1
+        self._seq     = 0
+        self._lock    = threading.Lock()
+
+    @property
+    def node(self):
+        if self._node is None:
+            env = os.getenv("ID_NODE")
+            # Raw client: allocation must not join a caller's pipelined() block
+            self._node = (int(env) if env is not None else r.raw.incr(NODE_COUNTER)) & MAX_NODE
+        return self._node
+
+    def reset(self):
+        """Forget the node and sequence (a forked child must not reuse its parent's)."""
+        self._node, self._last_ms, self._seq = None, -1, 0
+
+    def next_int(self):
+        node = self.node
+        with self._lock:
+            now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+            if now_ms <= self._last_ms:
+                # Same millisecond, or the clock stepped back: stay monotonic
+                now_ms = self._last_ms
+                self._seq = (self._seq + 1) & MAX_SEQ
+                if self._seq == 0:
+                    now_ms += 1  # sequence exhausted: borrow the next millisecond
+            else:
+                self._seq = 0
+            self._last_ms = now_ms
+            return (now_ms << (NODE_BITS + SEQ_BITS)) | (node << SEQ_BITS) | self._seq
+
+    def next_id(self):
+        return f"{self.next_int():0{ID_WIDTH}x}"
+
+
+_generator = IdGenerator()
+os.register_at_fork(after_in_child=_generator.reset)
+
+
+def new_id(prefix=None):
+    """A new unique, time-ordered id, as f"{prefix}_{id}" when a prefix is given."""
+    uid = _generator.next_id()
+    return f"{prefix}_{uid}" if prefix else uid
+
+
+def id_timestamp(obj_id):
+    """Creation time (epoch seconds) encoded in an id from new_id()."""
+    value = int(obj_id.rsplit("_", 1)[-1], 16)
+    return ((value >> (NODE_BITS + SEQ_BITS)) + ID_EPOCH_MS) / 1000
+
+
+def id_bounds(since=None, until=None, prefix=None):
+    """
+    Smallest and largest possible ids created between `since` and `until`
+    (epoch seconds, inclusive), for range scans over sorted ids.
+    """
+    def bound(ts, fill):
+        ms = 0 if ts is None else max(0, int(ts * 1000) - ID_EPOCH_MS)
+        value = (ms << (NODE_BITS + SEQ_BITS)) | fill
+        if ts is None and fill:
+            value = (1 << (ID_WIDTH * 4)) - 1
+        uid = f"{value:0{ID_WIDTH}x}"
+        return f"{prefix}_{uid}" if prefix else uid
+    return bound(since, 0), bound(until, (1 << (NODE_BITS + SEQ_BITS)) - 1)
@@ -0,0 +1,917 @@
+# db/memory.py
+
+import bisect
+import fnmatch
+import queue
+import random
+import threading
+import time
+from datetime import timedelta
+
+from redis.exceptions import ResponseError
+
+# In-process storage backend.
+# MemoryStore implements the subset of the redis-py client API the agents and
+# workers use (strings, counters, sets, hashes, lists, sorted sets, streams with
+# consumer groups, TTLs, SCAN, pub/sub, pipelines and WATCH-style transactions)
+# with decode_responses=True semantics, so get_client() can hand it out in
+# place of redis.Redis and the whole marketplace can run in a single process
+# without a Redis server.
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+def _encode(value):
+    """Coerce a value the way redis-py's encoder does, returning str."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        # Same mapping the pooled client uses for undecodable bytes
+        return value.decode("utf-8", "surrogateescape")
+    if isinstance(value, bool):
+        raise ResponseError("Invalid input of type: 'bool'")
+    if isinstance(value, (int, float)):
+        return repr(value)
+    raise ResponseError(f"Invalid input of type: '{type(value).__name__}'")
+
+
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+def _float_str(value):
+    """Float reply text as Redis writes it ("3" rather than "3.0")."""
+    return f"{value:.17g}"
+
+
+def _score_bound(value):
+    """Parse a ZRANGEBYSCORE-style bound: number, "-inf"/"+inf" or "(excl"."""
+    if isinstance(value, str) and value.startswith("("):
+        return float(value[1:]), True
+    return float(value), False
+
+
+def _in_range(score, low, high):
+    (lo, lo_excl), (hi, hi_excl) = low, high
+    return (score > lo if lo_excl else score >= lo) and (score < hi if hi_excl else score <= hi)
+
+
+class _SortedSet(dict):
+    """member -> score"""
+
+    def ordered(self):
+        return sorted(self.items(), key=lambda item: (item[1], item[0]))
+
+
+def _stream_id(value):
+    """Parse "ms-seq" (or "ms") into a comparable tuple."""
+    ms, _, seq = str(value).partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _id_str(entry_id):
+    return f"{entry_id[0]}-{entry_id[1]}"
+
+
+class _Stream:
+    def __init__(self):
+        self.ids     = []   # sorted entry id tuples
+        self.entries = {}   # id tuple -> fields
+        self.last    = (0, 0)
+        self.groups  = {}   # name -> _ConsumerGroup
+
+    def after(self, entry_id, count=None):
+        start = bisect.bisect_right(self.ids, entry_id)
+        ids = self.ids[start:start + count] if count else self.ids[start:]
+        return [(i, self.entries[i]) for i in ids]
+
+    def trim(self, maxlen):
+        excess = len(self.ids) - maxlen
+        if excess > 0:
+            for i in self.ids[:excess]:
+                del self.entries[i]
+            del self.ids[:excess]
+        return max(excess, 0)
+
+
+class _ConsumerGroup:
+    def __init__(self, last_delivered):
+        self.last_delivered = last_delivered
+        self.pending = {}   # id tuple -> [consumer, delivered_at (monotonic), deliveries]
+
+
+def _flatten(keys, args):
+    keys = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+    return keys + list(args)
+
+
+class MemoryStore:
+    """
+    Thread-safe in-process stand-in for redis.Redis.
+    Keys with a TTL are expired lazily when touched and on SCAN.
+    """
+
+    def __init__(self):
+        self._lock     = threading.RLock()
+        self._data     = {}
+        self._expiry   = {}  # key -> time.monotonic() deadline
+        self._channels = {}  # channel -> set of MemoryPubSub
+        self._appended = threading.Condition(self._lock)  # signalled on XADD
+
+    # ─── Internals ─────────────────────────────────────────────────────────
+    def _alive(self, key):
+        deadline = self._expiry.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return key in self._data
+
+    def _get_typed(self, key, kind):
+        if not self._alive(key):
+            return None
+        value = self._data[key]
+        if type(value) is not kind:
+            raise ResponseError(WRONGTYPE)
+        return value
+
+    def _get_or_create(self, key, kind):
+        value = self._get_typed(key, kind)
+        if value is None:
+            value = self._data[key] = kind()
+        return value
+
+    def _drop_if_empty(self, key):
+        if not self._data.get(key):
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+
+    # ─── Connection / server ───────────────────────────────────────────────
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+    def flushdb(self, asynchronous=False):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+        return True
+
+    def run_atomic(self, func, keys, args):
+        """
+        Run func(store, keys, args) as one atomic step: the in-process
+        counterpart of a server-side script (see db/scripts.py).
+        """
+        with self._lock:
+            return func(self, keys, args)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MemoryPipeline(self)
+
+    def transaction(self, func, *watches, shard_hint=None, value_from_callable=False, watch_delay=None):
+        """
+        Equivalent of redis-py's WATCH/MULTI/EXEC helper: the callable and the
+        commands it queues run under the store lock, so no retry is needed.
+        """
+        with self._lock:
+            pipe  = MemoryPipeline(self, immediate=True)
+            value = func(pipe)
+            results = pipe.execute()
+        return value if value_from_callable else results
+
+    def pubsub(self, ignore_subscribe_messages=False, **kwargs):
+        return MemoryPubSub(self, ignore_subscribe_messages)
+
+    # ─── Keys ──────────────────────────────────────────────────────────────
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for k in names if self._alive(k))
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for k in names:
+                if self._alive(k):
+                    del self._data[k]
+                    self._expiry.pop(k, None)
+                    removed += 1
+            return removed
+
+    unlink = delete
+
+    def type(self, name):
+        with self._lock:
+            if not self._alive(name):
+                return "none"
+            return {str: "string", set: "set", dict: "hash", list: "list", _SortedSet: "zset",
+                    _Stream: "stream"}[type(self._data[name])]
+
+    def expire(self, name, time_):
+        with self._lock:
+            if not self._alive(name):
+                return False
+            self._expiry[name] = time.monotonic() + _seconds(time_)
+            return True
+
+    def persist(self, name):
+        with self._lock:
+            return self._alive(name) and self._expiry.pop(name, None) is not None
+
+    def ttl(self, name):
+        with self._lock:
+            if not self._alive(name):
+                return -2
+            deadline = self._expiry.get(name)
+            if deadline is None:
+                return -1
+            return max(0, round(deadline - time.monotonic()))
+
+    def keys(self, pattern="*"):
+        return list(self.scan_iter(match=pattern))
+
+    def scan(self, cursor=0, match=None, count=None, _type=None):
+        with self._lock:
+            names = sorted(k for k in list(self._data) if self._alive(k))
+        count = count or 10
+        page  = names[cursor:cursor + count]
+        if match:
+            page = [k for k in page if fnmatch.fnmatchcase(k, match)]
+        next_cursor = cursor + count
+        return (0 if next_cursor >= len(names) else next_cursor), page
+
+    def scan_iter(self, match=None, count=None, _type=None):
+        # One snapshot for the whole walk instead of one per page
+        with self._lock:
+            names = [k for k in list(self._data) if self._alive(k)]
+        for k in names:
+            if not match or fnmatch.fnmatchcase(k, match):
+                yield k
+
+    # ─── Strings & counters ────────────────────────────────────────────────
+    def get(self, name):
+        with self._lock:
+            return self._get_typed(name, str)
+
+    def mget(self, keys, *args):
+        with self._lock:
+            out = []
+            for k in _flatten(keys, args):
+                value = self._data.get(k) if self._alive(k) else None
+                out.append(value if isinstance(value, str) else None)
+            return out
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        with self._lock:
+            exists = self._alive(name)
+            if (nx and exists) or (xx and not exists):
+                return None
+            self._data[name] = _encode(value)
+            if ex is not None:
+                self._expiry[name] = time.monotonic() + _seconds(ex)
+            elif px is not None:
+                self._expiry[name] = time.monotonic() + _seconds(px) / 1000.0
+            elif not keepttl:
+                self._expiry.pop(name, None)
+            return True
+
+    def setex(self, name, time_, value):
+        return self.set(name, value, ex=time_)
+
+    def setnx(self, name, value):
+        return bool(self.set(name, value, nx=True))
+
+    def incrby(self, name, amount=1):
+        with self._lock:
+            current = self._get_typed(name, str)
+            try:
+                value = int(current or 0) + int(amount)
+            except ValueError:
+                raise ResponseError("value is not an integer or out of range")
+            self._data[name] = str(value)
+            return value
+
+    def incrbyfloat(self, name, amount=1.0):
+        with self._lock:
+            current = self._get_typed(name, str)
+            try:
+                value = float(current or 0) + float(amount)
+            except ValueError:
+                raise ResponseError("value is not a valid float")
+            self._data[name] = _float_str(value)
+            return value
+
+    def incr(self, name, amount=1):
+        return self.incrby(name, amount)
+
+    def decr(self, name, amount=1):
+        return self.incrby(name, -amount)
+
+    # ─── Sets ──────────────────────────────────────────────────────────────
+    def sadd(self, name, *values):
+        with self._lock:
+            members = self._get_or_create(name, set)
+            before  = len(members)
+            members.update(_encode(v) for v in values)
+            return len(members) - before
+
+    def srem(self, name, *values):
+        with self._lock:
+            members = self._get_typed(name, set)
+            if members is None:
+                return 0
+            before = len(members)
+            members.difference_update(_encode(v) for v in values)
+            removed = before - len(members)
+            self._drop_if_empty(name)
+            return removed
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self._get_typed(name, set) or ())
+
+    def sismember(self, name, value):
+        with self._lock:
+            return _encode(value) in (self._get_typed(name, set) or ())
+
+    def smismember(self, name, values, *args):
+        values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+        values += args
+        with self._lock:
+            members = self._get_typed(name, set) or ()
+            return [int(_encode(v) in members) for v in values]
+
+    def sscan_iter(self, name, match=None, count=None):
+        with self._lock:
+            members = list(self._get_typed(name, set) or ())
+        for m in members:
+            if not match or fnmatch.fnmatchcase(m, match):
+                yield m
+
+    def scard(self, name):
+        with self._lock:
+            return len(self._get_typed(name, set) or ())
+
+    def sinter(self, keys, *args):
+        with self._lock:
+            sets = [self._get_typed(k, set) or set() for k in _flatten(keys, args)]
+            return set.intersection(*sets) if sets else set()
+
+    def sunion(self, keys, *args):
+        with self._lock:
+            return set().union(*(self._get_typed(k, set) or () for k in _flatten(keys, args)))
+
+    def srandmember(self, name, number=None):
+        with self._lock:
+            members = list(self._get_typed(name, set) or ())
+        if number is None:
+            return random.choice(members) if members else None
+        if number >= 0:
+            return random.sample(members, min(number, len(members)))
+        return [random.choice(members) for _ in range(-number)] if members else []
+
+    # ─── Hashes ────────────────────────────────────────────────────────────
+    def hset(self, name, key=None, value=None, mapping=None, items=None):
+        pairs = dict(mapping or {})
+        if key is not None:
+            pairs[key] = value
+        if items:
+            pairs.update(zip(items[::2], items[1::2]))
+        if not pairs:
+            raise ResponseError("'hset' with no key value pairs")
+        with self._lock:
+            fields = self._get_or_create(name, dict)
+            added  = sum(1 for k in pairs if k not in fields)
+            fields.update({_encode(k): _encode(v) for k, v in pairs.items()})
+            return added
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            fields = self._get_or_create(name, dict)
+            key = _encode(key)
+            if key in fields:
+                return False
+            fields[key] = _encode(value)
+            return True
+
+    def hget(self, name, key):
+        with self._lock:
+            return (self._get_typed(name, dict) or {}).get(key)
+
+    def hmget(self, name, keys, *args):
+        with self._lock:
+            fields = self._get_typed(name, dict) or {}
+            return [fields.get(k) for k in _flatten(keys, args)]
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._get_typed(name, dict) or {})
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            fields = self._get_typed(name, dict)
+            if fields is None:
+                return 0
+            removed = sum(1 for k in keys if fields.pop(k, None) is not None)
+            self._drop_if_empty(name)
+            return removed
+
+    def hexists(self, name, key):
+        with self._lock:
+            return key in (self._get_typed(name, dict) or {})
+
+    def hlen(self, name):
+        with self._lock:
+            return len(self._get_typed(name, dict) or {})
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            fields = self._get_or_create(name, dict)
+            value  = int(fields.get(key, 0)) + int(amount)
+            fields[key] = str(value)
+            return value
+
+    def hincrbyfloat(self, name, key, amount=1.0):
+        with self._lock:
+            fields = self._get_or_create(name, dict)
+            value  = float(fields.get(key, 0)) + float(amount)
+            fields[key] = _float_str(value)
+            return value
+
+    # ─── Lists ─────────────────────────────────────────────────────────────
+    def rpush(self, name, *values):
+        with self._lock:
+            items = self._get_or_create(name, list)
+            items.extend(_encode(v) for v in values)
+            return len(items)
+
+    def lpush(self, name, *values):
+        with self._lock:
+            items = self._get_or_create(name, list)
+            for v in values:
+                items.insert(0, _encode(v))
+            return len(items)
+
+    @staticmethod
+    def _range(length, start, end):
+        if start < 0:
+            start = max(length + start, 0)
+        end = length + end if end < 0 else min(end, length - 1)
+        return start, end + 1
+
+    def lrange(self, name, start, end):
+        with self._lock:
+            items = self._get_typed(name, list) or []
+            lo, hi = self._range(len(items), start, end)
+            return list(items[lo:hi])
+
+    def ltrim(self, name, start, end):
+        with self._lock:
+            items = self._get_typed(name, list)
+            if items is not None:
+                lo, hi = self._range(len(items), start, end)
+                items[:] = items[lo:hi]
+                self._drop_if_empty(name)
+            return True
+
+    def llen(self, name):
+        with self._lock:
+            return len(self._get_typed(name, list) or ())
+
+    # ─── Sorted sets ───────────────────────────────────────────────────────
+    def zadd(self, name, mapping, nx=False, xx=False, ch=False, incr=False, gt=False, lt=False):
+        with self._lock:
+            zset = self._get_or_create(name, _SortedSet)
+            changed = 0
+            result  = None
+            for member, score in mapping.items():
+                member, score = _encode(member), float(score)
+                old = zset.get(member)
+                if (nx and old is not None) or (xx and old is None):
+                    continue
+                if incr:
+                    score += old or 0.0
+                if old is not None and ((gt and score <= old) or (lt and score >= old)):
+                    continue
+                if old is None or old != score:
+                    changed += 1 if (ch or old is None) else 0
+                zset[member] = score
+                result = score
+            self._drop_if_empty(name)
+            return result if incr else changed
+
+    def zincrby(self, name, amount, value):
+        return self.zadd(name, {value: amount}, incr=True)
+
+    def zrem(self, name, *values):
+        with self._lock:
+            zset = self._get_typed(name, _SortedSet)
+            if zset is None:
+                return 0
+            removed = sum(1 for v in values if zset.pop(_encode(v), None) is not None)
+            self._drop_if_empty(name)
+            return removed
+
+    def zscore(self, name, value):
+        with self._lock:
+            return (self._get_typed(name, _SortedSet) or {}).get(_encode(value))
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._get_typed(name, _SortedSet) or ())
+
+    def zcount(self, name, min, max):
+        low, high = _score_bound(min), _score_bound(max)
+        with self._lock:
+            zset = self._get_typed(name, _SortedSet) or {}
+            return sum(1 for score in zset.values() if _in_range(score, low, high))
+
+    @staticmethod
+    def _reply(items, withscores):
+        return [(m, s) for m, s in items] if withscores else [m for m, _ in items]
+
+    def zrange(self, name, start, end, desc=False, withscores=False, score_cast_func=float,
+               byscore=False, bylex=False, offset=None, num=None):
+        if byscore:
+            if desc:
+                return self.zrevrangebyscore(name, start, end, offset, num, withscores)
+            return self.zrangebyscore(name, start, end, offset, num, withscores)
+        with self._lock:
+            items = (self._get_typed(name, _SortedSet) or _SortedSet()).ordered()
+        if desc:
+            items.reverse()
+        lo, hi = self._range(len(items), start, end)
+        return self._reply(items[lo:hi], withscores)
+
+    def zrevrange(self, name, start, end, withscores=False):
+        return self.zrange(name, start, end, desc=True, withscores=withscores)
+
+    def zrangebyscore(self, name, min, max, start=None, num=None, withscores=False):
+        low, high = _score_bound(min), _score_bound(max)
+        with self._lock:
+            items = (self._get_typed(name, _SortedSet) or _SortedSet()).ordered()
+        items = [(m, s) for m, s in items if _in_range(s, low, high)]
+        if start is not None:
+            items = items[start:] if num is None or num < 0 else items[start:start + num]
+        return self._reply(items, withscores)
+
+    def zrevrangebyscore(self, name, max, min, start=None, num=None, withscores=False):
+        low, high = _score_bound(min), _score_bound(max)
+        with self._lock:
+            items = (self._get_typed(name, _SortedSet) or _SortedSet()).ordered()
+        items = [(m, s) for m, s in reversed(items) if _in_range(s, low, high)]
+        if start is not None:
+            items = items[start:] if num is None or num < 0 else items[start:start + num]
+        return self._reply(items, withscores)
+
+    def zremrangebyscore(self, name, min, max):
+        low, high = _score_bound(min), _score_bound(max)
+        with self._lock:
+            zset = self._get_typed(name, _SortedSet)
+            if zset is None:
+                return 0
+            doomed = [m for m, s in zset.items() if _in_range(s, low, high)]
+            for m in doomed:
+                del zset[m]
+            self._drop_if_empty(name)
+            return len(doomed)
+
+    def zremrangebyrank(self, name, min, max):
+        with self._lock:
+            zset = self._get_typed(name, _SortedSet)
+            if zset is None:
+                return 0
+            doomed = zset.ordered()
+            lo, hi = self._range(len(doomed), min, max)
+            doomed = doomed[lo:hi]
+            for m, _ in doomed:
+                del zset[m]
+            self._drop_if_empty(name)
+            return len(doomed)
+
+    def zpopmin(self, name, count=None):
+        with self._lock:
+            zset = self._get_typed(name, _SortedSet)
+            if zset is None:
+                return []
+            items = zset.ordered()[:count or 1]
+            for m, _ in items:
+                del zset[m]
+            self._drop_if_empty(name)
+            return items
+
+    # ─── Streams ───────────────────────────────────────────────────────────
+    def _stream_fields(self, fields):
+        return {_encode(k): _encode(v) for k, v in fields.items()}
+
+    def xadd(self, name, fields, id="*", maxlen=None, approximate=True, nomkstream=False,
+             minid=None, limit=None):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            if stream is None:
+                if nomkstream:
+                    return None
+                stream = self._data[name] = _Stream()
+            if id == "*":
+                ms = int(time.time() * 1000)
+                entry_id = (ms, 0) if ms > stream.last[0] else (stream.last[0], stream.last[1] + 1)
+            else:
+                entry_id = _stream_id(id)
+                if entry_id <= stream.last:
+                    raise ResponseError("The ID specified in XADD is equal or smaller than the target stream top item")
+            stream.ids.append(entry_id)
+            stream.entries[entry_id] = self._stream_fields(fields)
+            stream.last = entry_id
+            if maxlen is not None:
+                stream.trim(maxlen)
+            self._appended.notify_all()
+            return _id_str(entry_id)
+
+    def xlen(self, name):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            return len(stream.ids) if stream else 0
+
+    def xrange(self, name, min="-", max="+", count=None):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            if stream is None:
+                return []
+            lo = (0, 0) if min == "-" else _stream_id(min)
+            hi = (float("inf"), 0) if max == "+" else _stream_id(max)
+            out = [(_id_str(i), dict(stream.entries[i])) for i in stream.ids if lo <= i <= hi]
+        return out[:count] if count else out
+
+    def xrevrange(self, name, max="+", min="-", count=None):
+        out = self.xrange(name, min, max)[::-1]
+        return out[:count] if count else out
+
+    def xdel(self, name, *ids):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            if stream is None:
+                return 0
+            removed = 0
+            for i in map(_stream_id, ids):
+                if stream.entries.pop(i, None) is not None:
+                    stream.ids.remove(i)
+                    removed += 1
+            return removed
+
+    def xtrim(self, name, maxlen=None, approximate=True, minid=None, limit=None):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            return stream.trim(maxlen) if stream is not None and maxlen is not None else 0
+
+    def _wait_for_entries(self, poll, block):
+        """Run poll() until it returns something or `block` ms pass (0 = forever)."""
+        deadline = None if not block else time.monotonic() + block / 1000
+        with self._lock:
+            while True:
+                result = poll()
+                if result or block is None:
+                    return result
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return result
+                self._appended.wait(remaining)
+
+    def xread(self, streams, count=None, block=None):
+        def poll():
+            reply = []
+            for name, last in streams.items():
+                stream = self._get_typed(name, _Stream)
+                if stream is None:
+                    continue
+                since = stream.last if last == "$" else _stream_id(last)
+                entries = stream.after(since, count)
+                if entries:
+                    reply.append([name, [(_id_str(i), dict(f)) for i, f in entries]])
+            return reply
+        # "$" means "after the last entry at call time", not at each wake-up
+        with self._lock:
+            resolved = {}
+            for name, last in streams.items():
+                if last == "$":
+                    stream = self._get_typed(name, _Stream)
+                    last = _id_str(stream.last) if stream else "0-0"
+                resolved[name] = last
+            streams = resolved
+        return self._wait_for_entries(poll, block)
+
+    def _group(self, name, groupname):
+        stream = self._get_typed(name, _Stream)
+        group = stream.groups.get(groupname) if stream else None
+        if group is None:
+            raise ResponseError(f"NOGROUP No such key '{name}' or consumer group '{groupname}'")
+        return stream, group
+
+    def xgroup_create(self, name, groupname, id="$", mkstream=False, entries_read=None):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            if stream is None:
+                if not mkstream:
+                    raise ResponseError("The XGROUP subcommand requires the key to exist")
+                stream = self._data[name] = _Stream()
+            if groupname in stream.groups:
+                raise ResponseError("BUSYGROUP Consumer Group name already exists")
+            stream.groups[groupname] = _ConsumerGroup(stream.last if id == "$" else _stream_id(id))
+            return True
+
+    def xgroup_destroy(self, name, groupname):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            return bool(stream and stream.groups.pop(groupname, None))
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        def poll():
+            reply = []
+            now = time.monotonic()
+            for name, last in streams.items():
+                stream, group = self._group(name, groupname)
+                if last == ">":
+                    entries = stream.after(group.last_delivered, count)
+                    if entries:
+                        group.last_delivered = entries[-1][0]
+                        if not noack:
+                            for i, _ in entries:
+                                group.pending[i] = [consumername, now, 1]
+                else:
+                    # Replay this consumer's pending entries (None if since deleted)
+                    since = _stream_id(last)
+                    mine = sorted(i for i, p in group.pending.items() if p[0] == consumername and i > since)
+                    mine = mine[:count] if count else mine
+                    for i in mine:
+                        group.pending[i][1] = now
+                        group.pending[i][2] += 1
+                    entries = [(i, stream.entries.get(i)) for i in mine]
+                if entries:
+                    reply.append([name, [(_id_str(i), dict(f) if f is not None else None) for i, f in entries]])
+            return reply
+        replay = any(last != ">" for last in streams.values())
+        return self._wait_for_entries(poll, None if replay else block)
+
+    def xack(self, name, groupname, *ids):
+        with self._lock:
+            stream = self._get_typed(name, _Stream)
+            group = stream.groups.get(groupname) if stream else None
+            if group is None:
+                return 0
+            return sum(1 for i in map(_stream_id, ids) if group.pending.pop(i, None) is not None)
+
+    def xautoclaim(self, name, groupname, consumername, min_idle_time, start_id="0-0", count=None,
+                   justid=False):
+        with self._lock:
+            stream, group = self._group(name, groupname)
+            now = time.monotonic()
+            start = _stream_id(start_id)
+            candidates = sorted(i for i in group.pending if i >= start)
+            limit = count or 100
+            claimed, deleted, next_id = [], [], (0, 0)
+            for i in candidates:
+                if len(claimed) + len(deleted) >= limit:
+                    next_id = i
+                    break
+                entry = group.pending[i]
+                if (now - entry[1]) * 1000 < min_idle_time:
+                    continue
+                if i not in stream.entries:
+                    del group.pending[i]
+                    deleted.append(_id_str(i))
+                    continue
+                group.pending[i] = [consumername, now, entry[2] + 1]
+                claimed.append((_id_str(i), dict(stream.entries[i])))
+            if justid:
+                return [i for i, _ in claimed]
+            return [_id_str(next_id), claimed, deleted]
+
+    def xpending(self, name, groupname):
+        with self._lock:
+            _, group = self._group(name, groupname)
+            ids = sorted(group.pending)
+            consumers = {}
+            for p in group.pending.values():
+                consumers[p[0]] = consumers.get(p[0], 0) + 1
+            return {
+                "pending":   len(ids),
+                "min":       _id_str(ids[0]) if ids else None,
+                "max":       _id_str(ids[-1]) if ids else None,
+                "consumers": [{"name": c, "pending": n} for c, n in consumers.items()],
+            }
+
+    # ─── Pub/Sub ───────────────────────────────────────────────────────────
+    def publish(self, channel, message):
+        message = _encode(message)
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for sub in subscribers:
+            sub._deliver({"type": "message", "pattern": None,
+                          "channel": channel, "data": message})
+        return len(subscribers)
+
+
+class MemoryPipeline:
+    """
+    Queues commands and applies them under the store lock on execute(), so a
+    pipeline is atomic with respect to every other client of the store.
+    After watch() commands run immediately, as in redis-py, until multi().
+    """
+
+    def __init__(self, store, immediate=False):
+        self._store     = store
+        self._commands  = []
+        self._immediate = immediate
+
+    def watch(self, *names):
+        self._immediate = True
+
+    def unwatch(self):
+        pass
+
+    def multi(self):
+        self._immediate = False
+
+    def __getattr__(self, name):
+        method = getattr(self._store, name)
+        if self._immediate:
+            return method
+
+        def queue_command(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue_command
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def reset(self):
+        self._commands = []
+
+    def execute(self, raise_on_error=True):
+        commands, self._commands = self._commands, []
+        results = []
+        with self._store._lock:
+            for method, args, kwargs in commands:
+                try:
+                    results.append(method(*args, **kwargs))
+                except ResponseError as e:
+                    results.append(e)
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, ResponseError):
+                    raise result
+        return results
+
+
+class MemoryPubSub:
+    """
+    Subscriber handle; published messages are fanned out to a per-subscriber
+    queue, so listen() can run in its own thread like a redis-py PubSub.
+    """
+
+    def __init__(self, store, ignore_subscribe_messages=False):
+        self._store    = store
+        self._ignore   = ignore_subscribe_messages
+        self._queue    = queue.Queue()
+        self.channels  = set()
+
+    def _deliver(self, message):
+        self._queue.put(message)
+
+    def subscribe(self, *channels):
+        with self._store._lock:
+            for ch in channels:
+                self._store._channels.setdefault(ch, set()).add(self)
+                self.channels.add(ch)
+                if not self._ignore:
+                    self._queue.put({"type": "subscribe", "pattern": None,
+                                     "channel": ch, "data": len(self.channels)})
+
+    def unsubscribe(self, *channels):
+        with self._store._lock:
+            for ch in channels or list(self.channels):
+                self._store._channels.get(ch, set()).discard(self)
+                self.channels.discard(ch)
+
+    def close(self):
+        self.unsubscribe()
+
+    reset = close
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            if timeout:
+                return self._queue.get(timeout=timeout)
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def listen(self):
+        while self.channels or not self._queue.empty():
+            yield self._queue.get()
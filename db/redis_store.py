@@ -1,47 +1,322 @@
 # db/redis_store.py
 
 import os
-import redis
 import json
 from datetime import timedelta
 
-# Read Redis connection info from env (set in docker-compose.yml)
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+from db.client import get_client, pipelined
 
-r = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=0,
-    decode_responses=True
-)
+try:
+    import msgpack
+except ImportError:  # JSON-only deployments
+    msgpack = None
 
-def save_object(prefix, obj_id, data, ttl=None):
+# Keys requested per SCAN step and values fetched per MGET
+SCAN_BATCH_SIZE = int(os.getenv("REDIS_SCAN_BATCH", 1000))
+
+# Payload format written by encode(): "json" (default) or "msgpack".
+# decode() reads both, so the setting can be changed on a live keyspace.
+PAYLOAD_CODEC = os.getenv("PAYLOAD_CODEC", "json").lower()
+
+# How records are laid out: "blob" (default) stores each object as one encoded
+# string; "hash" stores one hash field per top-level attribute so single
+# fields can be read and updated in place. Pick one per keyspace.
+ENTITY_STORAGE = os.getenv("ENTITY_STORAGE", "blob").lower()
+
+r = get_client()
+
+# ─── Payload codec ─────────────────────────────────────────────────────────────
+# Plain JSON text is the legacy (unversioned) format. Binary payloads are
+# wrapped in an envelope: a 0xC1 marker byte (never a valid leading byte in
+# UTF-8, JSON or msgpack), a format version byte, then the body.
+ENVELOPE_MARKER = b"\xc1"
+MSGPACK_V1      = b"\x01"
+
+def encode(obj):
+    """
+    Serialise a payload once for storage and/or publishing, in PAYLOAD_CODEC.
+    """
+    if PAYLOAD_CODEC == "msgpack" and msgpack is not None:
+        return ENVELOPE_MARKER + MSGPACK_V1 + msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, separators=(",", ":"))
+
+def decode(raw):
+    """
+    Deserialise a payload written by encode() in any format, or legacy JSON.
+    Raises ValueError for undecodable data.
+    """
+    if isinstance(raw, str):
+        if not raw.startswith("\udcc1"):
+            return json.loads(raw)
+        # Binary envelope read through a decode_responses client; the pool
+        # decodes with surrogateescape, so this recovers the exact bytes
+        raw = raw.encode("utf-8", "surrogateescape")
+    if raw[:1] != ENVELOPE_MARKER:
+        return json.loads(raw)
+    version = raw[1:2]
+    if version == MSGPACK_V1:
+        if msgpack is None:
+            raise ValueError("msgpack payload found but msgpack is not installed")
+        return msgpack.unpackb(raw[2:], raw=False)
+    raise ValueError(f"unknown payload envelope version {version!r}")
+
+# Secondary indexes: the set f"idx:{prefix}:{field}:{value}" holds the ids of
+# every `prefix` object whose `field` equals `value`
+INDEX_PREFIX = "idx"
+
+def index_key(prefix, field, value):
+    return f"{INDEX_PREFIX}:{prefix}:{field}:{value}"
+
+def index_keys(prefix, indexes):
+    return [
+        index_key(prefix, field, value)
+        for field, value in (indexes or {}).items()
+        if value is not None
+    ]
+
+def record_fields(data):
+    """Per-field encoding of a record, as stored under hash storage."""
+    return {field: encode(value) for field, value in data.items()}
+
+def save_object(prefix, obj_id, data, ttl=None, indexes=None):
+    """
+    Persist `data` under f"{prefix}:{obj_id}" and add obj_id to the index set
+    of every field/value pair in `indexes`.
+    Record and index writes go out in one MULTI/EXEC, or join the caller's
+    pipelined() block if there is one and take on its semantics: under
+    pipelined(transaction=False) they are batched but not atomic, so with
+    hash storage a concurrent reader may briefly see the record without its
+    TTL or with only some of its fields.
+    Returns the encoded payload so callers can publish it without re-encoding.
+    """
     key = f"{prefix}:{obj_id}"
-    value = json.dumps(data)
-    if ttl:
-        r.setex(key, timedelta(seconds=ttl), value)
-    else:
-        r.set(key, value)
+    value = encode(data)
+    with pipelined():
+        if ENTITY_STORAGE == "hash":
+            r.delete(key)
+            r.hset(key, mapping=record_fields(data))
+            if ttl:
+                r.expire(key, timedelta(seconds=ttl))
+        elif ttl:
+            r.setex(key, timedelta(seconds=ttl), value)
+        else:
+            r.set(key, value)
+        for idx in index_keys(prefix, indexes):
+            r.sadd(idx, obj_id)
+    return value
+
+def delete_object(prefix, obj_id, indexes=None):
+    """
+    Delete f"{prefix}:{obj_id}" and drop obj_id from its index sets.
+    Returns whether the record existed, or None when joined to the caller's
+    pipelined() block (the reply only exists once that block has exited).
+    """
+    with pipelined() as batch:
+        r.delete(f"{prefix}:{obj_id}")
+        for idx in index_keys(prefix, indexes):
+            r.srem(idx, obj_id)
+    return bool(batch.results[0]) if batch.results is not None else None
+
+def _fetch(keys):
+    """
+    Read the raw records stored under `keys` in one round trip: an MGET, or
+    pipelined HGETALLs under hash storage. Missing records come back as None.
+    """
+    if ENTITY_STORAGE != "hash":
+        return r.mget(keys)
+    pipe = r.pipeline(transaction=False)
+    for k in keys:
+        pipe.hgetall(k)
+    return [
+        raw if isinstance(raw, dict) and raw else None
+        for raw in pipe.execute(raise_on_error=False)
+    ]
+
+def _decode_record(raw):
+    if isinstance(raw, dict):
+        return {field: decode(value) for field, value in raw.items()}
+    return decode(raw)
 
 def get_object(prefix, obj_id):
-    data = r.get(f"{prefix}:{obj_id}")
-    return json.loads(data) if data else None
+    data = _fetch([f"{prefix}:{obj_id}"])[0]
+    return _decode_record(data) if data else None
 
-def list_objects(prefix):
+def get_objects(prefix, obj_ids):
     """
-    Return all JSON‐decoded objects whose keys start with f"{prefix}:".
-    Automatically skips expired or missing entries.
+    Fetch several objects by id, one round trip per batch, skipping missing ones.
     """
-    keys = r.keys(f"{prefix}:*")
+    obj_ids = list(obj_ids)
     objects = []
-    for k in keys:
-        raw = r.get(k)
+    for start in range(0, len(obj_ids), SCAN_BATCH_SIZE):
+        chunk = obj_ids[start:start + SCAN_BATCH_SIZE]
+        objects.extend(_load_batch([f"{prefix}:{i}" for i in chunk]))
+    return objects
+
+def get_fields(prefix, obj_id, *fields):
+    """
+    Read only the named top-level fields of an object, e.g.
+    get_fields("offer", offer_id, "price", "provided_by").
+    Returns a dict (None for absent fields), or None if the object is missing.
+    Under hash storage only those fields leave Redis (HMGET).
+    """
+    key = f"{prefix}:{obj_id}"
+    if ENTITY_STORAGE == "hash":
+        values = r.hmget(key, fields)
+        if all(v is None for v in values):
+            return None
+        return {f: decode(v) if v is not None else None for f, v in zip(fields, values)}
+    obj = get_object(prefix, obj_id)
+    if obj is None:
+        return None
+    return {f: obj.get(f) for f in fields}
+
+def update_fields(prefix, obj_id, fields, ttl=None):
+    """
+    Atomically overwrite some top-level fields of an existing object and, if
+    `ttl` is given, reset its expiry. Never recreates a missing or expired
+    object; returns whether the update was applied.
+    Under hash storage this is a single HSET of just those fields; blob
+    records are re-encoded inside a WATCH/MULTI transaction. The update is
+    sent immediately even inside a pipelined() block.
+    """
+    key = f"{prefix}:{obj_id}"
+
+    def apply(pipe):
+        if ENTITY_STORAGE == "hash":
+            if not pipe.exists(key):
+                return False
+            pipe.multi()
+            pipe.hset(key, mapping=record_fields(fields))
+        else:
+            raw = pipe.get(key)
+            if raw is None:
+                return False
+            obj = decode(raw)
+            obj.update(fields)
+            pipe.multi()
+            pipe.set(key, encode(obj), keepttl=True)
+        if ttl:
+            pipe.expire(key, timedelta(seconds=ttl))
+        return True
+
+    return r.transaction(apply, key, value_from_callable=True)
+
+def find_ids(prefix, **criteria):
+    """
+    Return the ids of `prefix` objects matching every field=value criterion,
+    read straight from the index sets (SMEMBERS, or SINTER for several).
+    """
+    keys = index_keys(prefix, criteria)
+    if not keys:
+        return set()
+    return r.sinter(keys) if len(keys) > 1 else r.smembers(keys[0])
+
+def find_objects(prefix, **criteria):
+    """
+    Return the decoded `prefix` objects matching every field=value criterion.
+    Cost is proportional to the result size; ids whose records have expired
+    since they were indexed are pruned from the queried index sets.
+    """
+    ids = list(find_ids(prefix, **criteria))
+    objects, stale = [], []
+    for start in range(0, len(ids), SCAN_BATCH_SIZE):
+        chunk = ids[start:start + SCAN_BATCH_SIZE]
+        for obj_id, raw in zip(chunk, _fetch([f"{prefix}:{i}" for i in chunk])):
+            if raw is None:
+                stale.append(obj_id)
+                continue
+            try:
+                objects.append(_decode_record(raw))
+            except ValueError:
+                continue
+    if stale:
+        pipe = r.pipeline(transaction=False)
+        for idx in index_keys(prefix, criteria):
+            pipe.srem(idx, *stale)
+        pipe.execute()
+    return objects
+
+def prune_indexes(prefix, batch_size=SCAN_BATCH_SIZE):
+    """
+    Remove the ids whose record is gone (e.g. expired) from every `prefix`
+    index set; returns the number removed. Costs one SCAN of the keyspace
+    plus one EXISTS per indexed id, so run it periodically for objects saved
+    with a TTL (find_objects only prunes the sets it queries).
+    """
+    removed = 0
+    for idx in set(r.scan_iter(match=f"{INDEX_PREFIX}:{prefix}:*", count=batch_size)):
+        stale, batch = [], []
+        for obj_id in r.sscan_iter(idx, count=batch_size):
+            batch.append(obj_id)
+            if len(batch) >= batch_size:
+                stale += _missing(prefix, batch)
+                batch = []
+        if batch:
+            stale += _missing(prefix, batch)
+        for start in range(0, len(stale), batch_size):
+            removed += r.srem(idx, *stale[start:start + batch_size])
+    return removed
+
+def _missing(prefix, obj_ids):
+    pipe = r.pipeline(transaction=False)
+    for obj_id in obj_ids:
+        pipe.exists(f"{prefix}:{obj_id}")
+    return [obj_id for obj_id, exists in zip(obj_ids, pipe.execute()) if not exists]
+
+def _load_batch(keys):
+    """
+    Fetch a batch of keys in one round trip and yield the decoded objects,
+    skipping entries that expired between SCAN and the fetch.
+    """
+    for raw in _fetch(keys):
         if raw is None:
             continue  # skip expired/missing
         try:
-            obj = json.loads(raw)
-        except json.JSONDecodeError:
+            yield _decode_record(raw)
+        except ValueError:
             continue  # or log a warning
-        objects.append(obj)
-    return objects
\ No newline at end of file
+
+def iter_objects(prefix, batch_size=SCAN_BATCH_SIZE):
+    """
+    Stream all decoded objects whose keys start with f"{prefix}:".
+    Walks the keyspace incrementally with SCAN (so other clients are never
+    stalled the way KEYS stalls them) and loads values one fetch per batch,
+    so a full listing costs roughly N / batch_size round trips.
+    """
+    seen  = set()  # SCAN may return a key more than once
+    batch = []
+    for key in r.scan_iter(match=f"{prefix}:*", count=batch_size):
+        if key in seen:
+            continue
+        seen.add(key)
+        batch.append(key)
+        if len(batch) >= batch_size:
+            yield from _load_batch(batch)
+            batch = []
+    if batch:
+        yield from _load_batch(batch)
+
+def iter_ids(prefix, batch_size=SCAN_BATCH_SIZE):
+    """
+    Stream the ids of all `prefix` objects in batches (lists), from SCAN alone,
+    without loading any record.
+    """
+    seen, batch = set(), []
+    start = len(prefix) + 1
+    for key in r.scan_iter(match=f"{prefix}:*", count=batch_size):
+        if key in seen:
+            continue
+        seen.add(key)
+        batch.append(key[start:])
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def list_objects(prefix):
+    """
+    Return all decoded objects whose keys start with f"{prefix}:".
+    Automatically skips expired or missing entries.
+    """
+    return list(iter_objects(prefix))
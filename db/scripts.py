@@ -0,0 +1,58 @@
+# db/scripts.py
+
+import threading
+
+from db.client import get_client
+
+# Server-side atomic scripts.
+# A compound agent operation is declared once as Lua plus an equivalent
+# Python function. On Redis the Lua is loaded on first use and then invoked
+# by SHA (EVALSHA, reloading transparently after a SCRIPT FLUSH or restart),
+# so the whole operation is one atomic round trip. On the in-process backend
+# the Python function runs under the store lock instead.
+
+_registry = {}  # name -> AtomicScript
+
+
+class AtomicScript:
+    def __init__(self, name, lua, fallback):
+        self.name     = name
+        self.lua      = lua
+        self.fallback = fallback  # fallback(store, keys, args)
+        self._script  = None
+        self._lock    = threading.Lock()
+
+    def _redis_script(self, client):
+        if self._script is None:
+            with self._lock:
+                if self._script is None:
+                    self._script = client.register_script(self.lua)
+        return self._script
+
+    def __call__(self, keys=(), args=()):
+        """
+        Run the script now (it is never queued on a pipelined() block) and
+        return its reply.
+        """
+        client = get_client().raw
+        run_atomic = getattr(client, "run_atomic", None)
+        if run_atomic is not None:
+            return run_atomic(self.fallback, list(keys), list(args))
+        return self._redis_script(client)(keys=list(keys), args=list(args))
+
+
+def register_script(name, lua, fallback):
+    script = _registry[name] = AtomicScript(name, lua, fallback)
+    return script
+
+
+def preload_scripts():
+    """
+    SCRIPT LOAD every registered script up front (e.g. at worker start-up)
+    so the first call of each is already a plain EVALSHA.
+    """
+    client = get_client().raw
+    if getattr(client, "run_atomic", None) is not None:
+        return
+    for script in _registry.values():
+        client.script_load(script._redis_script(client).script)
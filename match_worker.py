@@ -1,90 +1,305 @@
 import os
-import json
 import time
-import redis
+
+import numpy as np
 
 # Import agent helpers for polling loop
-from agents.needs_agent import get_current_needs
-from agents.opportunity_agent import get_current_offers, negotiate_price, adjust_offer_price
+from agents.needs_agent import get_current_needs, NEEDS_STREAM, NEEDS_REMOVED_STREAM
+from agents.opportunity_agent import (
+    get_current_offers, negotiate_price, negotiation_outcome, adjust_offer_price,
+    OFFERS_STREAM, OFFERS_REMOVED_STREAM,
+)
 from agents.needs_agent import remove_need
-from agents.insight_agent import process_match
+from agents.insight_agent import score_match
+from agents.match_engine import candidate_offers, WorkingSet
+from agents.match_shards import ShardMembership
+from agents.score_pool import best_offers, STATUS_NAMES, SCORE_POOL_SIZE
+from agents.assignment import assign
+from agents.trace_log import record_trace
+from agents.insight_agent import offer_product_name
+from db.client import get_client
+from db.events import EventTail
+from db.scripts import preload_scripts
+from analytics import metrics
 
 # Redis connection
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+r = get_client()
+
+# "events" (default): incremental matcher driven by stream events;
+# "poll": rebuild and match the full working set every poll interval
+MATCH_MODE = os.getenv("MATCH_MODE", "events").lower()
+
+# Full-cycle selection: "greedy" (first usable offer per need, lowest
+# latency) or "assign" (global assignment respecting offer capacity). Offers
+# are unbounded unless MATCH_OFFER_CAPACITY or an offer's "capacity" is set,
+# and without a limit "assign" just gives each need its best-weighted offer:
+# the assignment solver only comes into play once capacity is set.
+MATCH_STRATEGY = os.getenv("MATCH_STRATEGY", "greedy").lower()
+
+# Seconds between full reconciliation sweeps in events mode
+MATCH_RECONCILE_INTERVAL = float(os.getenv("MATCH_RECONCILE_INTERVAL", 30))
+
+MATCH_EVENT_STREAMS = (NEEDS_STREAM, OFFERS_STREAM, NEEDS_REMOVED_STREAM, OFFERS_REMOVED_STREAM)
+
+def settle_match(need, offer, score, negotiation=None):
+    """
+    Negotiate a scored need/offer pair (unless its `negotiation` was already
+    computed), adjust the offer on a counter-offer, remove the need and
+    publish the trace.
+    Returns the trace; `offer` is updated in place if its price changed.
+    """
+    user_id  = need.get("user_id")
+    need_id  = need.get("need_id")
+    offer_id = offer.get("offer_id")
+
+    # 2) Negotiate
+    negotiation = negotiation or negotiate_price(need, offer)
+    status = negotiation.get("status")
+
+    print(f"▶️ Negotiation status for {need_id}: {status} for {user_id}")
+
+    # 3) Counter-offer
+    if status == "counter-offer":
+        new_price = need.get("preferences", {}).get("price_max")
+        updated = adjust_offer_price(offer_id, new_price, offer=offer)
+        if updated:
+            offer.update(updated)
+            print(f"▶️ Offer updated {need_id}: {updated} for {user_id}")
+
+    # 4) Accept
+    need_removed = False
+    if status == "accepted":
+        if remove_need(need_id, need=need):
+            need_removed = True
+            print(f"▶️ Offer approved, need removed {need_id} for {user_id}")
+            metrics.incr("needs_met")
+    else:
+        if remove_need(need_id, need=need):
+            need_removed = True
+            print(f"▶️ Final offer rejected need removed {need_id} for {user_id}")
+            metrics.incr("needs_not_met")
+
+    # 5) Trace
+    trace = {
+        "user_id":     user_id,
+        "need_id":     need_id,
+        "offer_id":    offer_id,
+        "score":       score,
+        "negotiation": negotiation,
+        "need_removed": need_removed,
+        "timestamp":   time.time()
+    }
+    record_trace(trace)
+    return trace
+
+def run_match_cycle(needs, offers):
+    """
+    Match already-loaded needs against offers: join on product name, then
+    settle each need with the first candidate offer that scores above zero
+    (settling always removes the need, so later offers are not considered).
+    Returns the number of needs settled.
+    With SCORE_POOL_SIZE > 0 the selection runs vectorised (on the process
+    pool for large cycles) and only the settling happens here; with
+    MATCH_STRATEGY=assign the cycle is solved as a global assignment instead.
+    """
+    if MATCH_STRATEGY == "assign":
+        return run_assignment_cycle(needs, offers)
+    if SCORE_POOL_SIZE > 0:
+        return run_scored_cycle(needs, offers)
+    settled = 0
+    for need, candidates in candidate_offers(needs, offers):
+        for offer in candidates:
+            # 1) Score match
+            score = score_match(need, offer).get("score", 0)
+            if score <= 0:
+                continue
+            settle_match(need, offer, score)
+            settled += 1
+            break
+    return settled
+
+def settle_selected(needs, offers, selected):
+    """
+    Settle (need_index, offer_index, score, status_code) selections with
+    their precomputed negotiation, except that an offer already repriced by
+    a counter-offer earlier in the cycle is renegotiated at its new price.
+    """
+    repriced = set()
+    settled  = 0
+    for i, j, score, status in selected:
+        need, offer = needs[i], offers[j]
+        negotiation = None if j in repriced else negotiation_outcome(need, offer, STATUS_NAMES[status])
+        trace = settle_match(need, offer, score, negotiation=negotiation)
+        if trace["negotiation"]["status"] == "counter-offer":
+            repriced.add(j)
+        settled += 1
+    return settled
+
+def run_scored_cycle(needs, offers):
+    """Settle each need with the offer picked by score_pool.best_offers."""
+    best, scores, status = best_offers(needs, offers)
+    return settle_selected(needs, offers, (
+        (int(i), int(best[i]), float(scores[i]), int(status[i]))
+        for i in np.flatnonzero(best >= 0)
+    ))
+
+def run_assignment_cycle(needs, offers):
+    """
+    Settle the cycle's global assignment (agents/assignment.py); needs with
+    no acceptable offer stay open for a later cycle.
+    """
+    return settle_selected(needs, offers, assign(needs, offers))
+
+def owned_needs(membership, needs):
+    return [n for n in needs if membership.owns(n.get("product_name"))]
+
+def owned_offers(membership, offers):
+    return [o for o in offers if membership.owns(offer_product_name(o))]
 
 def run_match_worker(poll_interval: float = 5.0):
     """
     Polls all active needs and offers continuously:
       1) Fetch all needs and offers
-      2) Score each need/offfer pair
-      3) Negotiate, adjust prices, remove satisfied needs
-      4) Publish traces
+      2) Keep those in this worker's shards
+      3) Join them on product name and score candidate pairs
+      4) Negotiate, adjust prices, remove satisfied needs
+      5) Publish traces
     """
     print(f"▶️ Match worker started — polling every {poll_interval}s…")
-    while True:
-        needs = get_current_needs()
-        offers = get_current_offers()
-        for offer in offers:
-            offer_id = offer.get("offer_id")
-            for need in needs:
-                user_id = need.get("user_id")
-                need_id = need.get("need_id")
-
-                # Tag‐based pre‐filter
-                need_tags  = set(need.get("preferences", {}).get("tags", []))
-                offer_tags = set(offer.get("product",  {}).get("tags", []))
-                if need_tags and not (need_tags & offer_tags):
-                    # skip non‐overlapping
-                    continue
-
-                # 1) Score match
-                match = process_match(user_id, offer_id)
-                score = match.get("score", 0)
-                if score <= 0:
-                    continue
-                # 2) Negotiate
-                negotiation = negotiate_price(need, offer)
-                status = negotiation.get("status")
-
-                print(f"▶️ Negotiation status for {need_id}: {status} for {user_id}")
-
-                # 3) Counter-offer
-                if status == "counter-offer":
-                    new_price = need.get("preferences", {}).get("price_max")
-                    updated = adjust_offer_price(offer_id, new_price)
-                    if updated:
-                        offer = updated
-                        print(f"▶️ Offer updated {need_id}: {updated} for {user_id}")
-
-                # 4) Accept
-                need_removed = False
-                if status == "accepted":
-                    if remove_need(need_id):
-                        need_removed = True
-                        print(f"▶️ Offer approved, need removed {need_id} for {user_id}")
-                        r.incr("metrics:needs_met")
-                else:
-                    if remove_need(need_id):
-                        need_removed = True
-                        print(f"▶️ Final offer rejected need removed {need_id} for {user_id}")
-                        r.incr("metrics:needs_not_met")
-
-                # 5) Trace
-                trace = {
-                    "user_id":     user_id,
-                    "need_id":     need_id,
-                    "offer_id":    offer_id,
-                    "score":       score,
-                    "negotiation": negotiation,
-                    "need_removed": need_removed,
-                    "timestamp":   time.time()
-                }
-                r.rpush(f"match_traces:{user_id}", json.dumps(trace))
-                r.publish("match_traces_stream", json.dumps(trace))
-                
-        time.sleep(poll_interval)
+    preload_scripts()
+    membership = ShardMembership()
+    try:
+        while True:
+            membership.maybe_heartbeat()
+            started = time.perf_counter()
+            run_match_cycle(
+                owned_needs(membership, get_current_needs()),
+                owned_offers(membership, get_current_offers()),
+            )
+            metrics.observe("match_cycle_seconds", time.perf_counter() - started)
+            time.sleep(poll_interval)
+    finally:
+        membership.leave()
+
+# ─── Incremental (event-driven) matching ───────────────────────────────────
+# The working set is loaded once, then kept current from the need/offer
+# streams: a new need is scored only against live offers for its product and
+# a new or repriced offer only against the needs waiting for it. Expiry (TTL)
+# produces no event, so a pair is checked for liveness just before settling,
+# and a periodic sweep reloads the working set to repair anything missed.
+
+def _pair_is_live(need, offer):
+    """One round trip: do the need and offer records both still exist?"""
+    pipe = r.pipeline(transaction=False)
+    pipe.exists(f"need:{need.get('need_id')}")
+    pipe.exists(f"offer:{offer.get('offer_id')}")
+    return [bool(n) for n in pipe.execute()]
+
+def _try_settle(working_set, need, offer):
+    """
+    Settle the pair if it scores above zero and both sides are still live.
+    Returns True once the need is gone (settled or expired).
+    """
+    score = score_match(need, offer).get("score", 0)
+    if score <= 0:
+        return False
+    need_live, offer_live = _pair_is_live(need, offer)
+    if not offer_live:
+        working_set.remove_offer(offer.get("offer_id"))
+    if not need_live:
+        working_set.remove_need(need.get("need_id"))
+        return True
+    if not offer_live:
+        return False
+    settle_match(need, offer, score)
+    working_set.remove_need(need.get("need_id"))
+    return True
+
+def match_new_need(working_set, need):
+    """Settle a newly seen need with its first usable live offer."""
+    for offer in working_set.offers_for(need):
+        if _try_settle(working_set, need, offer):
+            return True
+    return False
+
+def match_new_offer(working_set, offer):
+    """Settle every waiting need a new or repriced offer satisfies."""
+    settled = 0
+    for need in working_set.needs_for(offer):
+        if offer.get("offer_id") not in working_set.offers:
+            break  # expired while settling
+        if _try_settle(working_set, need, offer):
+            settled += 1
+    return settled
+
+def apply_match_event(working_set, membership, stream, payload):
+    """
+    Fold one stream event into the working set and match what it adds;
+    needs and offers outside this worker's shards are ignored.
+    """
+    if stream == NEEDS_STREAM:
+        if membership.owns(payload.get("product_name")):
+            working_set.add_need(payload)
+            match_new_need(working_set, payload)
+    elif stream == OFFERS_STREAM:
+        if membership.owns(offer_product_name(payload)):
+            working_set.add_offer(payload)
+            match_new_offer(working_set, payload)
+    elif stream == NEEDS_REMOVED_STREAM:
+        working_set.remove_need(payload.get("need_id"))
+    elif stream == OFFERS_REMOVED_STREAM:
+        working_set.remove_offer(payload.get("offer_id"))
+
+def reconcile(working_set, membership):
+    """Reload this worker's shards of the working set and match them in full."""
+    working_set.replace(
+        owned_needs(membership, get_current_needs()),
+        owned_offers(membership, get_current_offers()),
+    )
+    settled = run_match_cycle(list(working_set.needs.values()), list(working_set.offers.values()))
+    print(f"▶️ Match reconciliation: {len(working_set.needs)} needs, "
+          f"{len(working_set.offers)} offers, {settled} settled")
+    return settled
+
+def run_event_match_worker(reconcile_interval: float = MATCH_RECONCILE_INTERVAL):
+    """
+    Event-driven matcher:
+      1) Tail the need/offer creation and removal streams
+      2) Load and match the working set (reconciliation sweep)
+      3) Match each new need or offer against the working set as it arrives
+      4) Re-run the sweep every `reconcile_interval` seconds, after a
+         read error, or when this worker's shards change
+    Several replicas may run at once; each owns a shard of product names.
+    """
+    print(f"▶️ Match worker started — event-driven, reconciling every {reconcile_interval}s…")
+    preload_scripts()
+    membership = ShardMembership()
+    working_set = WorkingSet()
+    tail = None
+    next_sweep = 0.0
+    try:
+        while True:
+            try:
+                if membership.maybe_heartbeat():
+                    next_sweep = 0.0  # shards moved: load what we now own
+                if tail is None:
+                    # Fix the tail position before the sweep so nothing between them is missed
+                    tail = EventTail(*MATCH_EVENT_STREAMS)
+                    next_sweep = 0.0
+                if time.monotonic() >= next_sweep:
+                    reconcile(working_set, membership)
+                    next_sweep = time.monotonic() + reconcile_interval
+                for event in tail.read():
+                    apply_match_event(working_set, membership, event.stream, event.payload)
+            except Exception as e:
+                print(f"[match] event loop error: {e}; resyncing")
+                tail = None
+                time.sleep(1)
+    finally:
+        membership.leave()
 
 if __name__ == "__main__":
-    run_match_worker(poll_interval=1.0)
\ No newline at end of file
+    if MATCH_MODE == "poll":
+        run_match_worker(poll_interval=1.0)
+    else:
+        run_event_match_worker()
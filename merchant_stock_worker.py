@@ -1,76 +1,163 @@
 # merchant_stock_worker.py
 
-import os, json, time, redis
-from provider_manager import list_providers
-from agents.opportunity_agent import stock_product, MERCHANT_CATEGORIES
-from agents.supplier_agent import get_current_products
+import os
+from provider_manager import list_providers, PROVIDERS_STREAM
+from agents.opportunity_agent import stock_products, MERCHANT_CATEGORIES, MERCHANT_STOCK_PREFIX
+from agents.supplier_agent import PRODUCTS_STREAM
+from db.cache import register_cache, watch_stream
+from db.client import get_client, pipelined
+from db.events import EventConsumer
+from db.redis_store import find_ids, iter_ids
 
 # Redis connection
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    db=0,
-    decode_responses=True
-)
+r = get_client()
 
-def run_merchant_stock_worker():
-    # Initial catch-up: stock every existing product
-    print("▶️ Merchant Stock Worker initial catch-up: stocking existing products…")
-    for product in get_current_products():
-        prod_id = product.get("product_id")
-        category = product.get("attributes", {}).get("category")
-        if not prod_id:
-            continue
-        for merchant in list_providers():
-            allowed = MERCHANT_CATEGORIES.get(merchant)
-            # Specialized merchants only stock matching categories
-            if allowed:
-                if category in allowed:
-                    stock_product(merchant, prod_id)
-                    print(f"   📦 [Init] Stocked {prod_id} into {merchant} (specialized)")
-            else:
-                # Generic merchant: stock everything
-                stock_product(merchant, prod_id)
-                print(f"   📦 [Init] Stocked {prod_id} into {merchant} (generic)")
-
-    # Now listen for new product events
-    pubsub = r.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe("products_stream")
-    print("▶️ Merchant Stock Worker listening for new products…")
+# Consumer group sharing product events between stock worker replicas
+MERCHANT_STOCK_GROUP = "merchant_stock"
 
-    for msg in pubsub.listen():
-        if msg.get("type") != "message":
-            continue
-        try:
-            product = json.loads(msg["data"])
-        except json.JSONDecodeError:
-            continue
+# Live stocking stops adding to a merchant once it holds this many products
+MERCHANT_STOCK_LIMIT = int(os.getenv("MERCHANT_STOCK_LIMIT", 100))
+# Product events handled per batch / product ids per SADD during catch-up
+STOCK_EVENT_BATCH    = int(os.getenv("STOCK_EVENT_BATCH", 500))
+STOCK_CATCHUP_BATCH  = int(os.getenv("STOCK_CATCHUP_BATCH", 5000))
+
+# ─── Routing table ────────────────────────────────────────────────────────────
+# Category -> specialized merchants stocking it, plus the generic merchants
+# that stock everything. Built from the registered providers and
+# MERCHANT_CATEGORIES; evicted on every providers_stream event.
+route_cache = register_cache("stock_routes", maxsize=1)
+ROUTES = "routes"
+
+
+def _on_provider_event(event):
+    route_cache.invalidate(ROUTES)
+
+
+def _build_routes():
+    by_category, generic = {}, []
+    for merchant in sorted(list_providers()):
+        allowed = MERCHANT_CATEGORIES.get(merchant)
+        if allowed:
+            for category in allowed:
+                by_category.setdefault(category, []).append(merchant)
+        else:
+            generic.append(merchant)
+    return {"by_category": by_category, "generic": generic}
+
+
+def routing_table():
+    """The current routing table (rebuilt after any provider change)."""
+    # list_providers() subscribes the provider cache first, so its entry is
+    # evicted before ours on each event
+    list_providers()
+    watch_stream(PROVIDERS_STREAM, _on_provider_event)
+    return route_cache.get_or_load(ROUTES, _build_routes)
+
+
+def merchants_for(category, routes=None):
+    """Merchants eligible to stock a product of `category`."""
+    routes = routes or routing_table()
+    return routes["by_category"].get(category, []) + routes["generic"]
 
-        prod_id   = product.get("product_id")
-        category  = product.get("attributes", {}).get("category")
 
+# ─── Stocking ─────────────────────────────────────────────────────────────────
+def route_products(products, routes=None):
+    """Group product ids by eligible merchant: {merchant: [product_id, ...]}."""
+    routes = routes or routing_table()
+    by_merchant = {}
+    for product in products:
+        prod_id = product.get("product_id")
         if not prod_id:
             continue
+        category = product.get("attributes", {}).get("category")
+        for merchant in merchants_for(category, routes):
+            by_merchant.setdefault(merchant, []).append(prod_id)
+    return by_merchant
+
 
-        for merchant in list_providers():
-            stock_key = f"{MERCHANT_STOCK_PREFIX}{merchant}"
-            current_count = r.scard(stock_key)
-            if current_count >= 100:
-                print(f"   ⚠️ {merchant} already has {current_count} products (limit 100); skipping {prod_id}")
+def stock_new_products(products):
+    """
+    Stock a batch of new products into every eligible merchant, up to
+    MERCHANT_STOCK_LIMIT per merchant: one round trip for the stock sizes and
+    one for the multi-member adds. Returns {merchant: products stocked}.
+    """
+    by_merchant = route_products(products)
+    if not by_merchant:
+        return {}
+    merchants = list(by_merchant)
+    pipe = r.pipeline(transaction=False)
+    for merchant in merchants:
+        pipe.scard(f"{MERCHANT_STOCK_PREFIX}{merchant}")
+    counts = pipe.execute()
+
+    stocked = {}
+    with pipelined(transaction=False):
+        for merchant, count in zip(merchants, counts):
+            room = MERCHANT_STOCK_LIMIT - count
+            if room <= 0:
+                print(f"   ⚠️ {merchant} already has {count} products (limit {MERCHANT_STOCK_LIMIT}); "
+                      f"skipping {len(by_merchant[merchant])}")
                 continue
+            ids = by_merchant[merchant][:room]
+            stock_products(merchant, ids)
+            stocked[merchant] = len(ids)
+    return stocked
+
+
+def stock_new_product(product):
+    """Stock a newly created product into every eligible merchant."""
+    return stock_new_products([product])
+
+
+def bulk_stock_catalog():
+    """
+    Stock every existing product into its eligible merchants, reading product
+    ids only: specialized merchants from the category indexes, generic ones
+    from a SCAN of product keys. Writes go out as multi-member SADDs, one
+    pipeline per batch of ids. Returns {merchant: products sent}.
+    """
+    routes = routing_table()
+    sent = {}
+
+    def stock_batch(merchants, ids):
+        with pipelined(transaction=False):
+            for merchant in merchants:
+                stock_products(merchant, ids)
+                sent[merchant] = sent.get(merchant, 0) + len(ids)
+
+    for category, merchants in routes["by_category"].items():
+        ids = list(find_ids("product", category=category))
+        for start in range(0, len(ids), STOCK_CATCHUP_BATCH):
+            stock_batch(merchants, ids[start:start + STOCK_CATCHUP_BATCH])
 
-            allowed = MERCHANT_CATEGORIES.get(merchant)
-            if allowed:
-                # only stock matching category
-                if category in allowed:
-                    stock_product(merchant, prod_id)
-                    print(f"   📦 Stocked {prod_id} into {merchant} (specialized)")
-            else:
-                # generic merchant: stock everything
-                stock_product(merchant, prod_id)
-                print(f"   📦 Stocked {prod_id} into {merchant} (generic)")
+    if routes["generic"]:
+        for ids in iter_ids("product", batch_size=STOCK_CATCHUP_BATCH):
+            stock_batch(routes["generic"], ids)
+    return sent
 
-        time.sleep(0.01)
+
+def run_merchant_stock_worker():
+    # Join the group before the catch-up so products created meanwhile are
+    # delivered afterwards (stocking is idempotent)
+    consumer = EventConsumer(MERCHANT_STOCK_GROUP, PRODUCTS_STREAM)
+
+    # Initial catch-up: stock every existing product
+    print("▶️ Merchant Stock Worker initial catch-up: stocking existing products…")
+    for merchant, count in sorted(bulk_stock_catalog().items()):
+        print(f"   📦 [Init] Stocked {count} products into {merchant}")
+
+    # Now consume new product events
+    print("▶️ Merchant Stock Worker listening for new products…")
+
+    while True:
+        events = consumer.read(count=STOCK_EVENT_BATCH)
+        if not events:
+            continue
+        stocked = stock_new_products([event.payload for event in events])
+        consumer.ack(events)
+        if stocked:
+            print(f"   📦 Stocked {len(events)} new product(s): "
+                  + ", ".join(f"{m}+{n}" for m, n in sorted(stocked.items())))
 
 if __name__ == "__main__":
-    run_merchant_stock_worker()
\ No newline at end of file
+    run_merchant_stock_worker()
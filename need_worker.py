@@ -1,22 +1,21 @@
 # need_worker.py
 
-import os
 import time
 import json
 import random
-import redis
 
-from agents.needs_agent import process_user_preferences, detect_unsatisfied, get_current_needs
+from agents.needs_agent import process_user_preferences_batch, detect_unsatisfied, count_active_needs
 from agents.users_agent import list_users
-from agents.supplier_agent import get_current_products, list_suppliers
-from agents.opportunity_agent import get_current_offers, list_providers, list_stocked_products
+from agents.supplier_agent import list_suppliers
+from agents.opportunity_agent import count_stocked_merchants
+from db.client import get_client
+from db.redis_store import prune_indexes
+from analytics import metrics
 
 # ───────────────────────────────────────────────────────────────────────────────
-# Redis connection via environment variables
+# Redis connection (shared pool, see db/client.py)
 # ───────────────────────────────────────────────────────────────────────────────
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+r = get_client()
 
 # ───────────────────────────────────────────────────────────────────────────────
 # Configuration
@@ -25,65 +24,88 @@ r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
 NEED_INTERVAL    = 120    # seconds between generating new needs
 DEFAULT_NEED_TTL = 60    # seconds before each need auto-expires
 UNSAT_THRESHOLD = DEFAULT_NEED_TTL  # seconds before flagging unsatisfied
+MAX_ACTIVE_NEEDS = 1000  # no new needs while this many are active
+NEED_TAGS        = ["eco-friendly", "quiet", "budget", "fast-delivery"]
+INDEX_PRUNE_INTERVAL = 60  # seconds between sweeps dropping expired needs from the need indexes
 
-last_need_time = time.time()
+last_need_time  = time.time()
+last_prune_time = time.time()
 
 print(f"▶️ Need worker started — generating needs every {NEED_INTERVAL}s "
       f"with TTL={DEFAULT_NEED_TTL}s...")
 
+# ───────────────────────────────────────────────────────────────────────────────
+# One generation cycle: one need per user, bounded by MAX_ACTIVE_NEEDS
+# ───────────────────────────────────────────────────────────────────────────────
+def any_offers():
+    return next(r.scan_iter(match="offer:*", count=1000), None) is not None
+
+
+def random_prefs():
+    return {
+        "tags": random.sample(NEED_TAGS, k=2),
+        "price_max": random.choice([300, 400, 500, 600, 1000])
+    }
+
+
+def generate_needs(user_ids, max_active=MAX_ACTIVE_NEEDS):
+    """
+    Generate one need for each of `user_ids` (a random subset when fewer
+    than that many needs fit under `max_active` live needs) in one batched
+    write. Returns the needs created.
+    """
+    room = max_active - count_active_needs(DEFAULT_NEED_TTL)
+    if room <= 0:
+        print(f"  • Active needs >= {max_active}; skipping generation this cycle")
+        return []
+    if len(user_ids) > room:
+        user_ids = random.sample(user_ids, room)
+
+    started = time.perf_counter()
+    needs   = process_user_preferences_batch(
+        [(user_id, random_prefs()) for user_id in user_ids],
+        ttl=DEFAULT_NEED_TTL,
+    )
+    elapsed = time.perf_counter() - started
+    metrics.observe("need_batch_seconds", elapsed)
+    print(f"  • Generated {len(needs)} needs for {len(user_ids)} users in {elapsed:.2f}s"
+          + (f" ({len(needs) / elapsed:.0f}/s)" if elapsed > 0 and needs else ""))
+    return needs
+
+
 # ───────────────────────────────────────────────────────────────────────────────
 # Main loop: periodically generate new needs for all users
 # ───────────────────────────────────────────────────────────────────────────────
 def run_need_worker():
-    global last_need_time
+    global last_need_time, last_prune_time
     while True:
         now = time.time()
 
-        # … generate your needs as before …
-        if now - last_need_time >= NEED_INTERVAL:
-
-            user_ids = list_users()
+        # Drop expired needs from the need index sets (a full index scan, so not every cycle)
+        if now - last_prune_time >= INDEX_PRUNE_INTERVAL:
+            last_prune_time = now
+            pruned = prune_indexes("need")
+            if pruned:
+                print(f"  • Pruned {pruned} expired needs from need indexes")
 
+        if now - last_need_time >= NEED_INTERVAL:
             # skip entirely if there are no offers yet
-            if not get_current_offers():
+            if not any_offers():
                 print("  • No active offers yet; delaying need generation")
+            # --- only generate if someone has inventory ---
+            elif not count_stocked_merchants():
+                print("  • No merchant stock available; skipping needs this cycle")
+                last_need_time = now
             else:
+                generate_needs(list_users())
+                last_need_time = now
 
-                # --- only generate if someone has inventory ---
-                merchants = list_providers()
-                stocked_merchants = [m for m in merchants if list_stocked_products(m)]
-                if not stocked_merchants:
-                    print("  • No merchant stock available; skipping needs this cycle")
-                    last_need_time = now
-                    time.sleep(0.2)
-                    continue
-
-                for user_id in user_ids:                    
-                    # Fetch current active needs count
-                    active_needs = get_current_needs()
-                    if len(active_needs) >= 1000:
-                        print(f"  • Active needs ({len(active_needs)}) >= 1000; skipping generation this cycle")
-                    else:
-                        for user_id in user_ids:
-                            # Generate a need only for existing users
-                            prefs = {
-                                "tags": random.sample(
-                                    ["eco-friendly", "quiet", "budget", "fast-delivery"],
-                                    k=2
-                                ),
-                                "price_max": random.choice([300, 400, 500, 600, 1000])
-                            }
-                            need = process_user_preferences(user_id, prefs, ttl=DEFAULT_NEED_TTL)
-                            print(f"  • Generated need {need['need_id']} for {user_id}")
-
-                    last_need_time = now
-
-                    # After generating new needs, detect any unsatisfied ones past the threshold
-                    detect_unsatisfied(UNSAT_THRESHOLD)
-                    print(f"  • Checked for unsatisfied needs older than {UNSAT_THRESHOLD}s")
+                # After generating new needs, detect any unsatisfied ones past the threshold
+                flagged = detect_unsatisfied(UNSAT_THRESHOLD)
+                print(f"  • Flagged {len(flagged)} unsatisfied needs older than {UNSAT_THRESHOLD}s")
 
         # Small sleep to avoid busy-looping
         time.sleep(1)
 
 if __name__ == "__main__":
-    run_need_worker()
\ No newline at end of file
+    run_need_worker()
@@ -2,15 +2,16 @@
 
 import os
 import time
-import json
-import redis
-from agents.opportunity_agent import generate_offer
+from collections import deque
+from agents.opportunity_agent import offer_indexes, OFFERS_STREAM, PENDING_OFFERS_STREAM
+from db.redis_store import save_object, prune_indexes
+from db.client import get_client, pipelined
+from db.events import EventConsumer, publish_event, EVENT_BLOCK_MS
+from rate_limit import KeyedRateLimiter
 
 # Single Opportunity Agent Worker aggregating offers from multiple providers
-# Redis connection (via docker-compose env-vars)
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+# Redis connection (shared pool, see db/client.py)
+r = get_client()
 
 # ----- Configurable Parameters -----
 offer_interval    = 60  # seconds between new waves of offers
@@ -19,27 +20,87 @@ DEFAULT_OFFER_TTL = 3600  # seconds before each offer auto-expires
 # List of merchant/provider IDs to generate offers for
 MERCHANT_IDS = ["merchant_1", "merchant_2", "merchant_3"]
 STRATEGY     = "neutral"
-PENDING_OFFERS_STREAM = "pending_offers_stream"
+
+# Consumer group sharing pending offers between offer worker replicas
+OFFER_WORKERS_GROUP = "offer_workers"
 
 print("▶️ Offer worker started — aggregating offers from providers every "
       f"{offer_interval}s with TTL={DEFAULT_OFFER_TTL}s…")
 
 last_offer = time.time()
-ACTIVATION_INTERVAL = 0.5  # half‐second between activations
+
+# ----- Activation pipeline -----
+# Pending offers are drained in batches of up to ACTIVATION_BATCH; each batch
+# is written and published in one pipelined round trip. Throughput is capped
+# by token buckets (per process): a global rate and a per-merchant rate, in
+# offers/second (<= 0 disables a limit). Offers over the limit stay unacked and
+# are retried as soon as their buckets refill.
+ACTIVATION_BATCH          = int(os.getenv("OFFER_ACTIVATION_BATCH", 100))
+ACTIVATION_RATE           = float(os.getenv("OFFER_ACTIVATION_RATE", 200))
+ACTIVATION_BURST          = float(os.getenv("OFFER_ACTIVATION_BURST", ACTIVATION_RATE))
+MERCHANT_ACTIVATION_RATE  = float(os.getenv("OFFER_MERCHANT_ACTIVATION_RATE", 50))
+MERCHANT_ACTIVATION_BURST = float(os.getenv("OFFER_MERCHANT_ACTIVATION_BURST", MERCHANT_ACTIVATION_RATE))
+
+# Seconds between sweeps dropping expired offers from the offer index sets
+OFFER_INDEX_PRUNE_INTERVAL = float(os.getenv("OFFER_INDEX_PRUNE_INTERVAL", 60))
+
+
+def activation_limiter():
+    return KeyedRateLimiter(ACTIVATION_RATE, ACTIVATION_BURST,
+                            MERCHANT_ACTIVATION_RATE, MERCHANT_ACTIVATION_BURST)
+
+
+def activate_offers(offers):
+    """Save and publish a batch of offers as active, in one round trip."""
+    with pipelined(transaction=False):
+        for offer in offers:
+            payload = save_object("offer", offer["offer_id"], offer, ttl=DEFAULT_OFFER_TTL,
+                                  indexes=offer_indexes(offer))
+            publish_event(OFFERS_STREAM, payload)
+
+
+def admit(events, limiter):
+    """Split events into those the rate limits admit now and those deferred."""
+    ready, deferred = [], []
+    for event in events:
+        merchant = event.payload.get("provided_by")
+        (ready if limiter.try_acquire(merchant) else deferred).append(event)
+    return ready, deferred
+
 
 def run_offer_worker():
-    pubsub = r.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe(PENDING_OFFERS_STREAM)
-    print("▶️ Offer worker listening for pending offers…")
-    for msg in pubsub.listen():
-        if msg.get("type") != "message":
+    consumer = EventConsumer(OFFER_WORKERS_GROUP, PENDING_OFFERS_STREAM)
+    limiter  = activation_limiter()
+    deferred = deque()
+    next_prune = time.monotonic() + OFFER_INDEX_PRUNE_INTERVAL
+    print(f"▶️ Offer worker listening for pending offers "
+          f"(batch={ACTIVATION_BATCH}, rate={ACTIVATION_RATE}/s, per merchant={MERCHANT_ACTIVATION_RATE}/s)…")
+    while True:
+        if time.monotonic() >= next_prune:
+            next_prune = time.monotonic() + OFFER_INDEX_PRUNE_INTERVAL
+            pruned = prune_indexes("offer")
+            if pruned:
+                print(f"   🧹 Pruned {pruned} expired offers from offer indexes")
+
+        # Deferred offers go first; only top up with new ones (without blocking)
+        events = list(deferred)
+        deferred.clear()
+        room = ACTIVATION_BATCH - len(events)
+        if room > 0:
+            events += consumer.read(count=room, block=None if events else EVENT_BLOCK_MS)
+        if not events:
             continue
-        offer = json.loads(msg["data"])
-        # publish as active
-        r.setex(f"offer:{offer['offer_id']}", DEFAULT_OFFER_TTL, json.dumps(offer))
-        r.publish("offers_stream", json.dumps(offer))
-        print(f"   ✅ Activated pending offer {offer['offer_id']}")
-        time.sleep(ACTIVATION_INTERVAL)
+
+        ready, later = admit(events, limiter)
+        if ready:
+            activate_offers([e.payload for e in ready])
+            consumer.ack(ready)
+            print(f"   ✅ Activated {len(ready)} pending offer(s)"
+                  + (f", {len(later)} deferred by rate limit" if later else ""))
+        deferred.extend(later)
+        if later and not ready:
+            # Nothing admitted: sleep until the first deferred offer could be
+            time.sleep(min(limiter.wait_time(e.payload.get("provided_by")) for e in later))
 
 if __name__ == "__main__":
     run_offer_worker()
\ No newline at end of file
@@ -1,14 +1,13 @@
 import os
-import redis
-import json
 from datetime import datetime
+from db.client import get_client
+from db.redis_store import encode, decode
+from db.cache import register_cache, watch_stream
+from db.events import publish_event
 
 # Provider Manager: dynamic registration of offer providers (merchants)
 
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+r = get_client()
 
 # Redis key for storing provider IDs
 PROVIDERS_KEY = "providers:set"
@@ -16,6 +15,18 @@ PROVIDERS_KEY = "providers:set"
 # Redis channel to notify provider changes
 PROVIDERS_STREAM = "providers_stream"
 
+# In-process cache of the provider list and metadata, evicted on every
+# providers_stream event; the TTL bounds staleness if an event is missed
+PROVIDER_CACHE_SIZE = int(os.getenv("PROVIDER_CACHE_SIZE", 1024))
+PROVIDER_CACHE_TTL  = float(os.getenv("PROVIDER_CACHE_TTL", 30))
+provider_cache = register_cache("providers", maxsize=PROVIDER_CACHE_SIZE, ttl=PROVIDER_CACHE_TTL)
+ALL_PROVIDERS  = "__all__"
+
+
+def _on_provider_event(event):
+    provider_cache.invalidate(ALL_PROVIDERS)
+    provider_cache.invalidate(f"metadata:{event.get('provider_id')}")
+
 
 def register_provider(provider_id, metadata=None):
     """
@@ -23,10 +34,11 @@ def register_provider(provider_id, metadata=None):
     Stores provider_id in a Redis set and publishes an event.
     """
     added = r.sadd(PROVIDERS_KEY, provider_id)
+    provider_cache.invalidate(ALL_PROVIDERS)
     event = {"provider_id": provider_id, "action": "registered", "timestamp": datetime.utcnow().isoformat()}
     if metadata:
         event["metadata"] = metadata
-    r.publish(PROVIDERS_STREAM, json.dumps(event))
+    publish_event(PROVIDERS_STREAM, encode(event))
     return bool(added)
 
 
@@ -35,16 +47,18 @@ def unregister_provider(provider_id):
     Remove a provider and publish removal event.
     """
     removed = r.srem(PROVIDERS_KEY, provider_id)
+    provider_cache.invalidate(ALL_PROVIDERS)
     event = {"provider_id": provider_id, "action": "unregistered", "timestamp": datetime.utcnow().isoformat()}
-    r.publish(PROVIDERS_STREAM, json.dumps(event))
+    publish_event(PROVIDERS_STREAM, encode(event))
     return bool(removed)
 
 
 def list_providers():
     """
-    List all currently registered providers.
+    List all currently registered providers (cached in-process).
     """
-    return list(r.smembers(PROVIDERS_KEY))
+    watch_stream(PROVIDERS_STREAM, _on_provider_event)
+    return list(provider_cache.get_or_load(ALL_PROVIDERS, lambda: list(r.smembers(PROVIDERS_KEY))))
 
 
 def set_provider_metadata(provider_id, metadata):
@@ -52,15 +66,20 @@ def set_provider_metadata(provider_id, metadata):
     Store metadata under key 'provider:<id>:metadata' and publish update.
     """
     key = f"provider:{provider_id}:metadata"
-    r.set(key, json.dumps(metadata))
+    r.set(key, encode(metadata))
+    provider_cache.invalidate(f"metadata:{provider_id}")
     event = {"provider_id": provider_id, "action": "metadata_updated", "metadata": metadata, "timestamp": datetime.utcnow().isoformat()}
-    r.publish(PROVIDERS_STREAM, json.dumps(event))
+    publish_event(PROVIDERS_STREAM, encode(event))
     return True
 
 
 def get_provider_metadata(provider_id):
     """
-    Retrieve stored metadata for a provider.
+    Retrieve stored metadata for a provider (cached in-process).
     """
-    data = r.get(f"provider:{provider_id}:metadata")
-    return json.loads(data) if data else None
\ No newline at end of file
+    watch_stream(PROVIDERS_STREAM, _on_provider_event)
+
+    def load():
+        data = r.get(f"provider:{provider_id}:metadata")
+        return decode(data) if data else None
+    return provider_cache.get_or_load(f"metadata:{provider_id}", load)
\ No newline at end of file
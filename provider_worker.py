@@ -1,11 +1,9 @@
 # provider_worker.py
 
-import os
 import time
-import json
-import redis
 from provider_manager import register_provider, unregister_provider, list_providers
-from agents.opportunity_agent import generate_offer, stage_offer
+from agents.opportunity_agent import generate_offer, stage_offer, find_offers, remove_offer
+from db.client import get_client
 
 import random
 
@@ -13,9 +11,7 @@ import random
 STRATEGY = "neutral"
 
 # Redis connection
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+r = get_client()
 
 # Configuration
 CANDIDATE_PROVIDERS = [f"merchant_{i}" for i in range(1, 6)]
@@ -56,10 +52,8 @@ def run_provider_worker():
                 pid = existing[0]
                 unregister_provider(pid)
                 # Also delete its offers and publish removal events
-                for key in r.keys(f"offer:{pid}_*"):
-                    offer_id = key.split(":", 1)[1]
-                    r.delete(key)
-                    r.publish("offers_removed_stream", json.dumps({"offer_id": offer_id}))
+                for offer in find_offers(merchant=pid):
+                    remove_offer(offer["offer_id"])
                 print(f"  • Unregistered provider {pid} and removed its offers")
             last_unregister = now
 
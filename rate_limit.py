@@ -0,0 +1,77 @@
+# rate_limit.py
+
+import threading
+import time
+
+# In-process token-bucket rate limiting.
+# A bucket refills at `rate` tokens per second up to `burst`; each operation
+# takes one token. KeyedRateLimiter pairs a global bucket with one bucket per
+# key (e.g. per merchant) and only admits an operation when both have a
+# token. A rate <= 0 means unlimited.
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate   = float(rate)
+        self.burst  = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.stamp  = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp  = now
+
+    def available(self, now):
+        if self.unlimited:
+            return True
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        if not self.unlimited:
+            self.tokens -= 1
+
+    def wait_time(self, now):
+        """Seconds until a token is available."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class KeyedRateLimiter:
+    """Global token bucket plus one bucket per key; thread-safe."""
+
+    def __init__(self, rate, burst=None, per_key_rate=0, per_key_burst=None):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.per_key_rate  = per_key_rate
+        self.per_key_burst = per_key_burst
+        self._buckets = {}
+        self._lock    = threading.Lock()
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.per_key_rate, self.per_key_burst)
+        return bucket
+
+    def try_acquire(self, key):
+        """Take a token from both buckets if both have one; returns whether it did."""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(key)
+            if not (self.global_bucket.available(now) and bucket.available(now)):
+                return False
+            self.global_bucket.take()
+            bucket.take()
+            return True
+
+    def wait_time(self, key):
+        """Seconds until try_acquire(key) could succeed."""
+        with self._lock:
+            now = time.monotonic()
+            return max(self.global_bucket.wait_time(now), self._bucket(key).wait_time(now))
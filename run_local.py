@@ -0,0 +1,47 @@
+# run_local.py
+#
+# Run the whole marketplace in a single process on the in-process storage
+# backend (STORE_BACKEND=memory): every worker loop gets its own daemon thread
+# and they all share one MemoryStore, so no Redis server is needed.
+
+import os
+os.environ.setdefault("STORE_BACKEND", "memory")
+
+import threading
+import time
+
+from provider_manager import register_provider
+from agents.opportunity_agent import MERCHANT_CATEGORIES
+
+# Importing supplier_worker registers the suppliers and seeds the catalog
+from user_worker import run_user_worker
+from supplier_worker import run_supplier_worker
+from merchant_stock_worker import run_merchant_stock_worker
+from provider_worker import run_provider_worker
+from offer_worker import run_offer_worker
+from need_worker import run_need_worker
+from match_worker import run_event_match_worker
+
+WORKERS = [
+    run_user_worker,
+    run_supplier_worker,
+    run_merchant_stock_worker,
+    run_provider_worker,
+    run_offer_worker,
+    run_need_worker,
+    run_event_match_worker,
+]
+
+if __name__ == "__main__":
+    # Same specialised merchants the dashboard registers on start-up
+    for m in MERCHANT_CATEGORIES:
+        register_provider(m)
+
+    for target in WORKERS:
+        threading.Thread(target=target, name=target.__name__, daemon=True).start()
+    print(f"▶️ Local marketplace running {len(WORKERS)} workers in-process. Ctrl+C to quit.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
@@ -1,21 +1,16 @@
 # supplier_worker.py
 
-import os
 import time
 import random
-import redis
-from agents.supplier_agent import register_supplier, list_suppliers, generate_product
+from agents.supplier_agent import register_supplier, list_suppliers, generate_product, rebuild_product_registry
+from agents.tags import KNOWN_TAGS
+from db.client import get_client
 
-# Possible tags for products
-TAGS = [
-    "eco-friendly", "quiet", "budget", "fast-delivery",
-    "premium", "limited-edition", "new-arrival"
-]
+# Possible tags for products (the interned vocabulary, see agents/tags.py)
+TAGS = list(KNOWN_TAGS)
 
-# Read Redis connection info from env
-REDIS_HOST = os.getenv("REDIS_HOST", "redis")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+# Redis connection (shared pool, see db/client.py)
+r = get_client()
 
 # ───────────────────────────────────────────────────────────────────────────────
 # Supplier Classes and Initial Product Definitions
@@ -103,6 +98,9 @@ PRODUCT_INTERVAL = 10
 # ───────────────────────────────────────────────────────────────────────────────
 # Initialization: register suppliers and seed initial products
 # ───────────────────────────────────────────────────────────────────────────────
+# Products stored before the product-id registry existed
+print(f"• Product registry holds {rebuild_product_registry()} existing products")
+
 for sup, cls in zip(SUPPLIERS, SUPPLIER_CLASSES):
     register_supplier(sup)
     # Seed ten products for this supplier/class